@@ -1,22 +1,118 @@
-from flask import Flask, request, jsonify
-from utils.esp32 import Esp32
+from flask import Flask, Response, g, request, jsonify, stream_with_context, url_for
+from utils.config import load_config
+from utils.ingest import build_hub, run_ingest
+from utils.shared_hub import SharedHub
+from utils.hub_manager import UnknownDeviceError, NoDeviceError
 from utils.rag_client import RAGClient
+from utils.response_cache import ResponseCache
+from utils.rag_transport import RAGTransport, CircuitOpenError, TransportBusyError
+from utils.jobs import JobManager
+from utils.broadcaster import Broadcaster
+from utils.history_query import run_query
+from utils.air_quality import AirQualityAnalyzer
+from utils.log import get_logger, setup_logging
+from utils.metrics import (REGISTRY, HTTP_BUCKETS, broadcaster_collector, cache_collector, transport_collector,
+                           join_metrics, read_metrics, write_metrics)
+from utils.profiler import SamplingProfiler
+import atexit
+import glob
+import json
+import os
 import threading
 import time
 import sys
 
 app = Flask(__name__)
-esp32 = Esp32(port="/dev/ttyACM0", baudrate=115200, timeout=1)
-rag_client = RAGClient(api_url="http://10.143.202.13:5678/webhook/desiotone/ragchat")
+# Settings come from DESIOT_* environment variables (and the CLI when run directly); see utils/config.py.
+config = load_config(sys.argv[1:] if __name__ == '__main__' else None)
+setup_logging(config.log_level, config.log_format)
+log = get_logger("app")
+
+# Under serve.py a poll can reach another worker than the submit, so jobs are shared through data_dir.
+advice_jobs = JobManager(max_workers=4, ttl=600,
+                         path=os.path.join(config.data_dir, "jobs") if config.role == "web" else None)
+broadcaster = Broadcaster(max_buffer=64)
+if config.role == "web":
+    # Web worker under serve.py: the ingest process owns the serial ports.
+    hub = SharedHub(data_dir=config.data_dir, broadcaster=broadcaster).start()
+else:
+    hub = build_hub(config, broadcaster=broadcaster)
+rag_client = RAGClient(api_url=config.webhook_url,
+                       cache=ResponseCache(maxsize=256, ttl=600),
+                       transport=RAGTransport(connect_timeout=3.05, read_timeout=60, max_concurrent=4))
+analyzer = AirQualityAnalyzer(window=900)
+# Under serve.py every open stream holds one of the worker's threads, so
+# streams are capped to keep threads free for the other endpoints.
+stream_slots = threading.BoundedSemaphore(config.max_streams or max(1, config.threads // 2)) if config.role == "web" else None
+profiler = SamplingProfiler() if config.profiling else None
+
+HTTP_SECONDS = REGISTRY.histogram("desiot_http_request_seconds", "Time to the response headers per route.",
+                                  labels=("method", "route", "status"), buckets=HTTP_BUCKETS)
+REGISTRY.register(cache_collector("advice", rag_client.cache))
+REGISTRY.register(transport_collector(rag_client.transport))
+REGISTRY.register(broadcaster_collector(broadcaster))
+# Under serve.py every process publishes its metrics to METRICS_DIR every
+# METRICS_INTERVAL seconds: the ingest process its serial, ingest and uplink
+# metrics (see utils/ingest.py), each web worker its HTTP and RAG metrics.
+METRICS_DIR = os.path.join(config.data_dir, "metrics")
+METRICS_INTERVAL = 5
+METRICS_MAX_AGE = 6 * METRICS_INTERVAL  # older files belong to processes that are gone
+INGEST_METRICS = os.path.join(METRICS_DIR, "ingest.prom")
+WORKER_METRICS = os.path.join(METRICS_DIR, f"web-{os.getpid()}.prom")
+WORKER_LABELS = {"worker": str(os.getpid())} if config.role == "web" else None
 
 def read_data():
+    """Starts the hub event loop and feeds every queued sample into its device's cache and store."""
+    run_ingest(hub)
+
+def publish_worker_metrics():
+    """Writes this worker's metrics for the /metrics of the other workers until the process exits."""
     while True:
-        """Continuously read data from the ESP32 and send it to ThingSpeak."""
         try:
-            esp32.read_data()
-        except Exception as e:
-            print(f"[ERROR] Failed to read data: {e}")
-        time.sleep(10)  # Adjust the sleep time as needed
+            write_metrics(WORKER_METRICS, labels=WORKER_LABELS)
+        except OSError as e:
+            log.error("Could not write metrics: %s", e)
+        time.sleep(METRICS_INTERVAL)
+
+def remove_worker_metrics():
+    try:
+        os.remove(WORKER_METRICS)
+    except OSError:
+        pass
+
+if config.role == "web":
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    threading.Thread(target=publish_worker_metrics, daemon=True, name="worker-metrics").start()
+    atexit.register(remove_worker_metrics)
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    # The route template, not the path, so /ai/advice/jobs/<job_id> stays one series.
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    HTTP_SECONDS.labels(request.method, route, response.status_code).observe(time.perf_counter() - g.request_start)
+    return response
+
+def analyze(esp32, data):
+    """Runs the local air-quality rules over the latest reading and the recent history of `esp32`."""
+    return analyzer.analyze(data, esp32.query(int(time.time()) - analyzer.window))
+
+def acquire_stream_slot():
+    """Reserves a stream slot. Returns the function that releases it, or None when every slot is taken."""
+    if stream_slots is None:
+        return lambda: None
+    if not stream_slots.acquire(blocking=False):
+        return None
+    return stream_slots.release
+
+def too_many_streams_response():
+    return jsonify({"status": "error", "message": "Too many open streams, try again later"}), 503
+
+def unknown_device_response(e):
+    return jsonify({"status": "error", "message": f"Unknown device {e}", "devices": hub.device_ids()}), 404
 
 @app.route('/', methods=['GET'])
 def simple_home():
@@ -31,50 +127,203 @@ def simple_home():
     <h1>Welcome to Desiot1</h1>
     <p>ESP32 data collector and RAG API.</p>
     <ul>
+        <li><a href="/sensor/devices">/sensor/devices</a> - connected ESP32 devices</li>
         <li><a href="/get_latest_data">/get_latest_data</a> - latest sensor reading</li>
+        <li><a href="/sensor/stream">/sensor/stream</a> - live sensor readings and anomaly events as server-sent events</li>
+        <li><a href="/sensor/anomalies">/sensor/anomalies</a> - recent anomaly events</li>
         <li><a href="/get_historical_data">/get_historical_data</a> - historical readings</li>
         <li>/get_recommendation - POST to get a recommendation</li>
+        <li>/ai/advice/jobs - POST to start a recommendation job, GET /ai/advice/jobs/&lt;id&gt; to poll it</li>
         <li>/chat - POST to chat with the RAG API</li>
+        <li>/chat/stream - POST to chat with the RAG API, answer streamed as server-sent events</li>
+        <li><a href="/metrics">/metrics</a> - Prometheus metrics</li>
     </ul>
     </body>
 </html>"""
     return html
 
 
+@app.route('/sensor/devices', methods=['GET'])
+def get_devices():
+    """Endpoint to list the connected ESP32 devices and their ingest counters."""
+    try:
+        return jsonify({"status": "success", "data": hub.stats()}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/sensor/latest', methods=['GET'])
 def get_latest_data():
-    """Endpoint to get the latest data from the ESP32."""
+    """Endpoint to get the latest data from an ESP32 (optional `device` parameter).
+
+    Answers If-None-Match with 304 while the reading has not changed.
+    """
     try:
-        data = esp32.get_latest_data()
-        if not data:
-            return jsonify({"status": "error", "message": "No data available"}), 400
-        
-        return jsonify({"status": "success", "data": data}), 200
+        snapshot = hub.get(request.args.get('device')).latest
+        response = Response(snapshot.body, mimetype="application/json", headers={"Cache-Control": "no-cache"})
+        response.set_etag(snapshot.etag)
+        return response.make_conditional(request)
+    except UnknownDeviceError as e:
+        return unknown_device_response(e)
+    except NoDeviceError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/sensor/stream', methods=['GET'])
+def stream_sensor_data():
+    """Endpoint to receive every accepted reading ("sample") and anomaly event ("anomaly") as server-sent events (optional `device` parameter)."""
+    device = request.args.get('device') or None
+    if device is not None:
+        # Reject unknown ids before they hold a stream slot open.
+        try:
+            hub.get(device)
+        except UnknownDeviceError as e:
+            return unknown_device_response(e)
+    release = acquire_stream_slot()
+    if release is None:
+        return too_many_streams_response()
+    try:
+        subscription = broadcaster.subscribe(device)
+    except RuntimeError as e:
+        release()
+        return jsonify({"status": "error", "message": str(e)}), 503
+
+    def generate():
+        try:
+            while True:
+                event = subscription.get(timeout=15)
+                if event is not None:
+                    yield event
+                elif subscription.closed:
+                    # Evicted for falling behind; the client reconnects.
+                    break
+                else:
+                    yield b": keepalive\n\n"
+        finally:
+            subscription.close()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(generate(), mimetype="text/event-stream", headers=headers)
+    # Runs when the server closes the response, even if the generator never started.
+    response.call_on_close(release)
+    return response
+
 @app.route('/sensor/history', methods=['GET'])
 def get_historical_data():
-    """Endpoint to get historical data from the ESP32."""
+    """Endpoint to get historical data from the ESP32.
+
+    Optional query parameters: device, start, end (epoch seconds or
+    YYYY-MM-DD HH:MM:SS), fields (comma separated), bucket (e.g. 1m, 1h),
+    agg (mean/min/max/std/p95/count) and limit (raw samples only).
+    """
     try:
-        data = esp32.get_historical_data()
+        esp32 = hub.get(request.args.get('device'))
+        data, query = run_query(
+            esp32,
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            fields=request.args.get('fields'),
+            bucket=request.args.get('bucket'),
+            agg=request.args.get('agg'),
+            limit=request.args.get('limit'),
+            rollups=esp32.rollups,
+        )
         if not data:
             return jsonify({"status": "error", "message": "No historical data available"}), 400
         
-        return jsonify({"status": "success", "data": data}), 200
+        query["device"] = esp32.device_id
+        return jsonify({"status": "success", "data": data, "query": query}), 200
+    except UnknownDeviceError as e:
+        return unknown_device_response(e)
+    except (NoDeviceError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/sensor/anomalies', methods=['GET'])
+def get_anomalies():
+    """Endpoint to get recent anomaly events (spikes, stuck readings) of an ESP32.
+
+    Optional query parameters: device, since (epoch seconds) and limit.
+    """
+    try:
+        esp32 = hub.get(request.args.get('device'))
+        if esp32.anomalies is None:
+            return jsonify({"status": "error", "message": "Anomaly detection is disabled"}), 400
+        since = request.args.get('since')
+        limit = request.args.get('limit')
+        events = esp32.anomalies.recent(limit=int(limit) if limit else None, since=float(since) if since else None)
+        return jsonify({"status": "success", "data": events, "device": esp32.device_id}), 200
+    except UnknownDeviceError as e:
+        return unknown_device_response(e)
+    except (NoDeviceError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/ai/advice', methods=['GET'])
 def get_recommendation():
-    """Endpoint to get a recommendation based on the latest data from the ESP32."""
+    """Endpoint to get a recommendation based on the latest data from an ESP32 (optional `device` parameter).
+
+    Normal readings are answered locally; only abnormal findings go to the RAG API.
+    """
     try:
+        esp32 = hub.get(request.args.get('device'))
         data = esp32.get_latest_data()
         if not data:
             return jsonify({"status": "error", "message": "No data available"}), 400
         
-        recommendation = rag_client.get_recommendation(data)
-        return jsonify({"status": "success", "recommendation": recommendation}), 200
+        report = analyze(esp32, data)
+        recommendation = rag_client.get_recommendation(data, report)
+        return jsonify({"status": "success", "recommendation": recommendation, "analysis": report}), 200
+    except (CircuitOpenError, TransportBusyError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    except UnknownDeviceError as e:
+        return unknown_device_response(e)
+    except NoDeviceError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/ai/advice/jobs', methods=['POST'])
+def submit_recommendation_job():
+    """Endpoint to start a recommendation for the latest data in the background; returns a job id to poll."""
+    try:
+        esp32 = hub.get(request.args.get('device'))
+        data = esp32.get_latest_data()
+        if not data:
+            return jsonify({"status": "error", "message": "No data available"}), 400
+
+        job_id = advice_jobs.submit(rag_client.get_recommendation, data, analyze(esp32, data))
+        status_url = url_for('get_recommendation_job', job_id=job_id)
+        return jsonify({"status": "success", "job_id": job_id, "status_url": status_url}), 202, {"Location": status_url}
+    except UnknownDeviceError as e:
+        return unknown_device_response(e)
+    except NoDeviceError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/ai/advice/jobs/<job_id>', methods=['GET'])
+def get_recommendation_job(job_id):
+    """Endpoint to poll a recommendation job."""
+    try:
+        job = advice_jobs.get(job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": "Unknown or expired job"}), 404
+        return jsonify({"status": "success", "job": job}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/ai/cache', methods=['GET'])
+def get_advice_cache_stats():
+    """Endpoint to get hit/miss counters of the recommendation cache."""
+    try:
+        if rag_client.cache is None:
+            return jsonify({"status": "error", "message": "Recommendation cache is disabled"}), 400
+        return jsonify({"status": "success", "data": rag_client.cache.stats()}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -88,13 +337,107 @@ def chat():
         
         response = rag_client.chat(message)
         return jsonify({"status": "success", "response": response}), 200
+    except (CircuitOpenError, TransportBusyError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-if __name__ == '__main__':
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Endpoint to scrape Prometheus metrics for this process (and the ingest process behind serve.py).
 
-    # Allow port to be specified as a command line argument, default to 5000
-    thread1 = threading.Thread(target=read_data)
+    Under serve.py every web worker's samples carry a `worker` label, and
+    any worker answers with the metrics of all of them.
+    """
+    text = REGISTRY.render(WORKER_LABELS)
+    if config.role == "web":
+        others = [path for path in glob.glob(os.path.join(METRICS_DIR, "web-*.prom")) if path != WORKER_METRICS]
+        text = join_metrics([text] + read_metrics(others + [INGEST_METRICS], max_age=METRICS_MAX_AGE))
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+@app.route('/debug/profile', methods=['GET'])
+def get_profile():
+    """Endpoint to read the sampling profiler: hottest functions and stacks, or `format=collapsed` for flame graphs."""
+    if profiler is None:
+        return jsonify({"status": "error", "message": "Profiling is disabled, start with --profiling"}), 404
+    if request.args.get('format') == 'collapsed':
+        return Response(profiler.collapsed(), mimetype="text/plain")
+    try:
+        top = int(request.args.get('top', 20))
+        if top < 1:
+            raise ValueError("top must be a positive integer")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "data": profiler.report(top=top)}), 200
+
+@app.route('/debug/profile/<action>', methods=['POST'])
+def toggle_profile(action):
+    """Endpoint to start (optional `interval` in seconds) or stop the sampling profiler of this worker."""
+    if profiler is None:
+        return jsonify({"status": "error", "message": "Profiling is disabled, start with --profiling"}), 404
+    try:
+        if action == 'start':
+            interval = request.args.get('interval')
+            changed = profiler.start(float(interval) if interval else None)
+        elif action == 'stop':
+            changed = profiler.stop()
+        else:
+            return jsonify({"status": "error", "message": "Unknown action, use start or stop"}), 404
+        return jsonify({"status": "success", "changed": changed, "running": profiler.running, "pid": os.getpid()}), 200
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+def sse_event(data, event=None):
+    """Formats one server-sent event."""
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in json.dumps(data).splitlines()]
+    return "\n".join(lines) + "\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Endpoint to chat with the RAG API, relaying the answer as server-sent events while it is generated."""
+    try:
+        message = request.json.get('message')
+        if not message:
+            return jsonify({"status": "error", "message": "No message provided"}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    release = acquire_stream_slot()
+    if release is None:
+        return too_many_streams_response()
+    try:
+        chunks = rag_client.chat_stream(message)
+        # Pull the first chunk here so upstream errors still get a proper status code.
+        first = next(chunks, None)
+    except (CircuitOpenError, TransportBusyError) as e:
+        release()
+        return jsonify({"status": "error", "message": str(e)}), 503
+    except Exception as e:
+        release()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    def generate():
+        try:
+            if first is not None:
+                yield sse_event({"content": first})
+            for chunk in chunks:
+                yield sse_event({"content": chunk})
+            yield sse_event({"status": "success"}, event="done")
+        except Exception as e:
+            yield sse_event({"status": "error", "message": str(e)}, event="error")
+        finally:
+            chunks.close()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+    response.call_on_close(release)
+    return response
+
+if __name__ == '__main__':
+    # Development mode: collector thread and Flask server in one process.
+    # Use serve.py for multiple workers and a separate ingest process.
+    thread1 = threading.Thread(target=read_data, daemon=True)
     thread1.start()
-    # port = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # The reloader would start a second collector fighting over the serial port.
+    app.run(host=config.host, port=config.port, debug=config.debug, use_reloader=False, threaded=True)
\ No newline at end of file
@@ -0,0 +1,20 @@
+import time
+import numpy as np
+
+
+def percentiles(values, scale=1000.0):
+    """Returns p50/p99/max of `values` (seconds) in milliseconds, or None when there are none."""
+    if not len(values):
+        return None
+    values = np.asarray(values, dtype=np.float64) * scale
+    p50, p99 = np.percentile(values, [50, 99])
+    return {"p50": round(float(p50), 3), "p99": round(float(p99), 3), "max": round(float(values.max()), 3)}
+
+
+def wait_for(predicate, timeout=10.0, interval=0.05):
+    """Polls `predicate` until it is true; raises TimeoutError after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Timed out waiting for the benchmark setup")
+        time.sleep(interval)
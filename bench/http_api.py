@@ -0,0 +1,145 @@
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import requests
+from werkzeug.serving import make_server
+from utils.rollup import Rollups
+from utils.sim_serial import synthetic_frames
+from utils.ts_store import TimeSeriesStore
+from bench.common import percentiles, wait_for
+
+DEVICE_ID = "http"
+
+
+def backfill(data_dir, seconds):
+    """Writes `seconds` of 1 Hz history ending now, so history queries have real work to do."""
+    store = TimeSeriesStore(os.path.join(data_dir, "history", DEVICE_ID))
+    rollups = Rollups(os.path.join(data_dir, "rollups", DEVICE_ID))
+    start = int(time.time()) - seconds
+    for i, frame in enumerate(synthetic_frames(seed=0, count=seconds)):
+        store.append(start + i, frame)
+        rollups.update(start + i, frame)
+    store.close()
+    rollups.flush()
+
+
+def load(url, duration, concurrency):
+    """Hammers `url` from `concurrency` threads for `duration` seconds."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        mine, failed = [], 0
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                response = session.get(url, timeout=10)
+                response.content
+                if response.status_code != 200:
+                    failed += 1
+                    continue
+            except requests.RequestException:
+                failed += 1
+                continue
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        "requests_per_s": round(len(latencies) / duration, 1),
+        "errors": sum(errors),
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def stream(url, duration, subscribers):
+    """Counts /sensor/stream events delivered to `subscribers` clients and their ingest-to-client latency."""
+    latencies = []
+    counts = []
+    lock = threading.Lock()
+    ready = threading.Barrier(subscribers + 1)
+
+    def client():
+        mine = []
+        with requests.get(url, stream=True, timeout=(5, duration + 5)) as response:
+            ready.wait()
+            stop = time.perf_counter() + duration
+            for line in response.iter_lines():
+                if line.startswith(b"data: "):
+                    data = json.loads(line[6:])
+                    if "sent" in data:
+                        mine.append(time.time() - data["sent"])
+                if time.perf_counter() >= stop:
+                    break
+        with lock:
+            latencies.extend(mine)
+            counts.append(len(mine))
+
+    threads = [threading.Thread(target=client) for _ in range(subscribers)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    return {
+        "subscribers": subscribers,
+        "events_per_s": round(sum(counts) / duration, 1),
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def run_http_bench(duration=5.0, concurrency=8, rate=50, subscribers=16, history_seconds=6 * 3600):
+    """Serves app.py over a simulated device and measures the /sensor endpoints.
+
+    The app runs in-process on the threaded Werkzeug server with its normal
+    ingest thread reading a sim: port at `rate` frames/s, on top of
+    `history_seconds` of backfilled history.
+    """
+    data_dir = tempfile.mkdtemp(prefix="desiot-bench-")
+    backfill(data_dir, history_seconds)
+    os.environ.update({
+        "DESIOT_SERIAL": f"sim:{DEVICE_ID}?rate={rate}&seed=1",
+        "DESIOT_DATA_DIR": data_dir,
+        "DESIOT_ROLE": "all",
+        "DESIOT_RESCAN_INTERVAL": "3600",
+        "DESIOT_LOG_LEVEL": "ERROR",
+    })
+    server = None
+    try:
+        app = importlib.import_module("app")
+        threading.Thread(target=app.read_data, daemon=True).start()
+        wait_for(lambda: app.hub.device_ids() and app.hub.get().latest.seq > 0)
+
+        server = make_server("127.0.0.1", 0, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+
+        now = int(time.time())
+        endpoints = {
+            "latest": "/sensor/latest",
+            "history_raw": "/sensor/history?limit=500",
+            "history_1h_p95": f"/sensor/history?start={now - 3600}&bucket=1m&agg=p95",
+            "history_6h_mean": f"/sensor/history?start={now - history_seconds}&bucket=5m&agg=mean",
+        }
+        results = {"server": "werkzeug", "concurrency": concurrency, "rate": rate}
+        for name, path in endpoints.items():
+            results[name] = load(base + path, duration, concurrency)
+        results["stream"] = stream(base + "/sensor/stream", duration, subscribers)
+        return results
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
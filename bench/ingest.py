@@ -0,0 +1,60 @@
+import shutil
+import tempfile
+import time
+from utils.config import load_config
+from utils.ingest import build_hub
+from bench.common import percentiles, wait_for
+
+
+def run_ingest_bench(devices=1, rate=0, duration=5.0, jitter=0.0, malformed=0.0, warmup=1.0):
+    """Feeds simulated ESP32s through the production ingest path and measures it.
+
+    Every device is a sim: port at `rate` frames/s (0: as fast as it is
+    read), so the run covers the pty, framing, parsing, the hub queue and
+    Esp32.process with its deadband filter, anomaly detector, history store
+    and rollups. Latency runs from the frame write to the moment the reading
+    is visible in Esp32.latest.
+    """
+    data_dir = tempfile.mkdtemp(prefix="desiot-bench-")
+    ports = ",".join(f"sim:bench{i}?rate={rate}&jitter={jitter}&malformed={malformed}&seed={i}" for i in range(devices))
+    hub = build_hub(load_config(["--serial", ports, "--data-dir", data_dir, "--rescan-interval", "3600"]))
+    try:
+        hub.start()
+        wait_for(lambda: len(hub.device_ids()) == devices)
+
+        deadline = time.perf_counter() + warmup
+        while time.perf_counter() < deadline:
+            hub.consume(timeout=0.1)
+
+        before = hub.stats()
+        processed = 0
+        latencies = []
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            data = hub.consume(timeout=0.1)
+            if data is None:
+                continue
+            processed += 1
+            if "sent" in data:
+                latencies.append(time.time() - data["sent"])
+        elapsed = time.perf_counter() - start
+        after = hub.stats()
+    finally:
+        hub.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    def delta(key):
+        return sum(after["devices"][d][key] - before["devices"][d][key] for d in after["devices"])
+
+    return {
+        "devices": devices,
+        "rate": rate,
+        "jitter": jitter,
+        "malformed": malformed,
+        "duration": round(elapsed, 3),
+        "lines_per_s": round(delta("lines") / elapsed, 1),
+        "samples_per_s": round(processed / elapsed, 1),
+        "parse_errors": delta("parse_errors"),
+        "drops": after["drops"] - before["drops"],
+        "latency_ms": percentiles(latencies),
+    }
@@ -0,0 +1,69 @@
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from utils.anomaly import AnomalyDetector
+from utils.deadband import DeadbandFilter
+from utils.ring_buffer import RingBuffer
+from utils.rollup import Rollups
+from utils.sim_serial import synthetic_frames
+from utils.ts_store import TimeSeriesStore
+
+PER_MILLION = 1_000_000
+
+
+def _disk_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def run_memory_bench(samples=PER_MILLION):
+    """Measures the RAM and disk cost of history, scaled to one million samples, plus append times."""
+    frames = list(synthetic_frames(seed=0, count=min(samples, 10_000)))
+    data_dir = tempfile.mkdtemp(prefix="desiot-bench-")
+    try:
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        ring = RingBuffer(samples)
+        ring_bytes = tracemalloc.get_traced_memory()[0] - base
+        start = time.perf_counter()
+        for i in range(samples):
+            ring.append(i, frames[i % len(frames)])
+        ring_append = (time.perf_counter() - start) / samples
+
+        base = tracemalloc.get_traced_memory()[0]
+        state = [DeadbandFilter(), AnomalyDetector()]
+        device_state_bytes = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+        del ring, state
+
+        store = TimeSeriesStore(os.path.join(data_dir, "history"))
+        start = time.perf_counter()
+        for i in range(samples):
+            store.append(i, frames[i % len(frames)])
+        store_append = (time.perf_counter() - start) / samples
+        store.close()
+
+        rollups = Rollups(os.path.join(data_dir, "rollups"))
+        count = min(samples, 100_000)
+        start = time.perf_counter()
+        for i in range(count):
+            rollups.update(i, frames[i % len(frames)])
+        rollup_update = (time.perf_counter() - start) / count
+        rollups.flush()
+
+        return {
+            "samples": samples,
+            "ring_buffer_bytes_per_million": round(ring_bytes * PER_MILLION / samples),
+            "store_disk_bytes_per_million": round(_disk_bytes(os.path.join(data_dir, "history")) * PER_MILLION / samples),
+            "rollup_disk_bytes": _disk_bytes(os.path.join(data_dir, "rollups")),
+            "device_state_bytes": device_state_bytes,
+            "ring_append_us": round(ring_append * 1e6, 3),
+            "store_append_us": round(store_append * 1e6, 3),
+            "rollup_update_us": round(rollup_update * 1e6, 3),
+            # ru_maxrss is KiB on Linux.
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
@@ -0,0 +1,117 @@
+"""End-to-end benchmarks for ingest, history storage and the HTTP API.
+
+No ESP32 is needed: devices are simulated through utils.sim_serial.
+
+    python -m bench.run                                  # everything, results in bench/results/
+    python -m bench.run --scenarios ingest --devices 1,8 --rate 200
+    python -m bench.run --compare bench/results/20261018-120000.json
+
+Results are written as JSON; --compare prints the change of every number
+against an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from utils.log import setup_logging
+
+SCENARIOS = ("ingest", "memory", "http")
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def flatten(results, prefix=""):
+    """Maps every number in nested results to its dotted path, e.g. ingest.0.latency_ms.p99."""
+    flat = {}
+    items = results.items() if isinstance(results, dict) else enumerate(results)
+    for key, value in items:
+        path = f"{prefix}{key}"
+        if isinstance(value, (dict, list)):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(previous, current):
+    old = flatten(previous["results"])
+    new = flatten(current["results"])
+    print(f"Compared with {previous['meta'].get('commit')} ({previous['meta'].get('time')}):")
+    for path in sorted(old.keys() & new.keys()):
+        change = f"{(new[path] - old[path]) / old[path] * 100:+.1f}%" if old[path] else ""
+        print(f"  {path}: {old[path]} -> {new[path]} {change}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Desiot1 benchmarks")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated: " + ", ".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per measurement")
+    parser.add_argument("--devices", default="1,4", help="comma separated device counts for the ingest runs")
+    parser.add_argument("--rate", type=float, default=100, help="frames/s per device for the paced ingest and HTTP runs")
+    parser.add_argument("--jitter", type=float, default=0.2, help="fraction of the frame period to jitter by")
+    parser.add_argument("--malformed", type=float, default=0.01, help="fraction of malformed frames")
+    parser.add_argument("--memory-samples", type=int, default=1_000_000, help="samples for the memory run")
+    parser.add_argument("--concurrency", type=int, default=8, help="HTTP client threads")
+    parser.add_argument("--subscribers", type=int, default=16, help="/sensor/stream clients")
+    parser.add_argument("--output", help="result file (default: bench/results/<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    # Only errors: per-reading and anomaly logging would skew the numbers.
+    setup_logging("ERROR")
+    results = {}
+    if "ingest" in scenarios:
+        from bench.ingest import run_ingest_bench
+        results["ingest"] = []
+        for devices in [int(d) for d in args.devices.split(",")]:
+            # Saturated (throughput) and paced (latency under a realistic load).
+            for rate in (0, args.rate):
+                print(f"[BENCH][INFO] ingest: {devices} device(s) at {rate or 'max'} frames/s", file=sys.stderr)
+                results["ingest"].append(run_ingest_bench(devices, rate, args.duration, args.jitter, args.malformed))
+    if "memory" in scenarios:
+        from bench.memory import run_memory_bench
+        print(f"[BENCH][INFO] memory: {args.memory_samples} samples", file=sys.stderr)
+        results["memory"] = run_memory_bench(args.memory_samples)
+    if "http" in scenarios:
+        from bench.http_api import run_http_bench
+        print("[BENCH][INFO] http", file=sys.stderr)
+        results["http"] = run_http_bench(args.duration, args.concurrency, args.rate, args.subscribers)
+
+    report = {"meta": metadata(args), "results": results}
+    output = args.output or os.path.join(os.path.dirname(__file__), "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"[BENCH][INFO] Results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
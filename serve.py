@@ -0,0 +1,110 @@
+"""Production entry point.
+
+Runs serial ingest in one dedicated process and the HTTP API in several
+worker processes that read the latest readings and history from the
+on-disk store under --data-dir.
+
+    python serve.py --workers 4 --port 8000 --serial /dev/ttyACM0,/dev/ttyACM1
+    python serve.py --role ingest          # ingest only, e.g. as its own service
+    python serve.py --role web --workers 4 # web workers only
+
+Every option can also be set as a DESIOT_<OPTION> environment variable.
+"""
+import os
+import signal
+import subprocess
+import sys
+from utils.config import load_config, export_config
+from utils.log import get_logger, setup_logging
+from utils import ingest
+
+log = get_logger("serve")
+
+
+def run_gunicorn(config):
+    from gunicorn.app.base import BaseApplication
+
+    class GunicornServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{config.host}:{config.port}")
+            self.cfg.set("workers", config.workers)
+            # Threaded workers, so long-lived /sensor/stream and /chat/stream
+            # responses do not pin a whole process each. Each still holds a
+            # thread, so app.py caps them at --max-streams per worker.
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", config.threads)
+            self.cfg.set("timeout", 120)
+
+        def load(self):
+            from app import app
+            return app
+
+    GunicornServer().run()
+
+
+def run_waitress(config):
+    from waitress import serve
+    from app import app
+    log.info("waitress serves from a single process; install gunicorn for multiple workers")
+    serve(app, host=config.host, port=config.port, threads=config.workers * config.threads)
+
+
+def run_flask(config):
+    from app import app
+    app.run(host=config.host, port=config.port, debug=config.debug, use_reloader=False, threaded=True)
+
+
+SERVERS = {"gunicorn": run_gunicorn, "waitress": run_waitress, "flask": run_flask}
+
+
+def serve_http(config):
+    """Runs the web workers with the configured server, or the best one installed for "auto"."""
+    if config.server != "auto":
+        if config.server not in SERVERS:
+            raise ValueError(f"Unknown server '{config.server}'. Available: auto, {', '.join(SERVERS)}")
+        return SERVERS[config.server](config)
+    for name in ("gunicorn", "waitress"):
+        try:
+            __import__(name)
+        except ImportError:
+            continue
+        return SERVERS[name](config)
+    log.warning("Neither gunicorn nor waitress is installed, falling back to the Flask development server")
+    return run_flask(config)
+
+
+def main(argv=None):
+    config = load_config(sys.argv[1:] if argv is None else argv)
+    # Worker processes import app.py and read their settings from the environment.
+    export_config(config)
+    setup_logging(config.log_level, config.log_format)
+
+    if config.role == "ingest":
+        return ingest.main()
+
+    ingest_process = None
+    if config.role == "all":
+        # A plain child process rather than multiprocessing, whose bookkeeping
+        # forked gunicorn workers would inherit. It reads the exported settings.
+        ingest_process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--role", "ingest"])
+        log.info("Ingest process started (pid %s)", ingest_process.pid)
+
+    os.environ["DESIOT_ROLE"] = "web"
+    # Turn SIGTERM into SystemExit so the ingest process is stopped below
+    # (gunicorn installs its own handlers and returns normally).
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    parent_pid = os.getpid()
+    try:
+        serve_http(config)
+    finally:
+        # Forked gunicorn workers unwind through here too; only the parent owns the ingest process.
+        if ingest_process is not None and os.getpid() == parent_pid:
+            ingest_process.terminate()
+            try:
+                ingest_process.wait(5)
+            except subprocess.TimeoutExpired:
+                ingest_process.kill()
+
+
+if __name__ == "__main__":
+    main()
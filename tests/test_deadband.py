@@ -0,0 +1,46 @@
+from utils.deadband import DeadbandFilter, DEFAULT_ABSOLUTE
+
+
+def reading(temperature, eco2=600):
+    return {"temperature": temperature, "humidity": 45.0, "eco2": eco2, "tvoc": 50, "aqi": 1}
+
+
+def passed(out):
+    return [ts for ts, _ in out]
+
+
+def test_deadband_passes_changes_and_heartbeats():
+    f = DeadbandFilter(max_silence=60)
+    assert passed(f.feed(0, reading(23.0))) == [0]
+    assert f.feed(1, reading(23.05)) == []
+    assert passed(f.feed(2, reading(23.2))) == [2]
+    assert f.feed(3, reading(23.2, eco2=605)) == []
+    assert passed(f.feed(4, reading(23.2, eco2=620))) == [4]
+    assert passed(f.feed(64, reading(23.2, eco2=620))) == [64]
+    assert f.stats() == {"received": 6, "passed": 4, "compression_ratio": 1.5}
+
+
+def test_relative_deadband():
+    f = DeadbandFilter(absolute={**DEFAULT_ABSOLUTE, "eco2": 1000}, relative={"eco2": 0.1})
+    f.feed(0, reading(23.0, eco2=1000))
+    assert f.feed(1, reading(23.0, eco2=1090)) == []
+    assert passed(f.feed(2, reading(23.0, eco2=1101))) == [2]
+
+
+def test_swinging_door_keeps_the_turning_point():
+    f = DeadbandFilter(absolute={"temperature": 0.1}, swinging_door=True)
+    out = f.feed(0, reading(20.0))
+    # A straight ramp fits one line, so nothing is archived while it lasts.
+    for ts in range(1, 10):
+        out += f.feed(ts, reading(20.0 + ts))
+    assert passed(out) == [0]
+    # The trend turns at t=9: that reading is archived when t=10 breaks the door.
+    out += f.feed(10, reading(29.0))
+    assert passed(out) == [0, 9]
+
+
+def test_keep_flushes_the_held_reading():
+    f = DeadbandFilter(absolute={"temperature": 0.1}, swinging_door=True)
+    f.feed(0, reading(20.0))
+    f.feed(1, reading(21.0))
+    assert passed(f.keep(2, reading(40.0))) == [1, 2]
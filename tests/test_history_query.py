@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from utils.history_query import run_query
+from utils.rollup import Rollups
+from utils.ts_store import TimeSeriesStore
+
+T0 = 1_790_000_000 + 17  # deliberately not aligned to any rollup resolution
+
+
+@pytest.fixture(scope="module")
+def history(tmp_path_factory):
+    """About ten days of irregular readings in a store with rollups kept alongside."""
+    path = tmp_path_factory.mktemp("history")
+    store = TimeSeriesStore(str(path / "history"))
+    rollups = Rollups(str(path / "rollups"))
+    rng = np.random.default_rng(1)
+    timestamps = T0 + np.cumsum(rng.integers(1, 30, size=60000))
+    for i, ts in enumerate(timestamps.tolist()):
+        data = {
+            "temperature": float(np.float32(20 + 5 * np.sin(i / 500) + rng.normal())),
+            "humidity": float(np.float32(40 + rng.normal())),
+            "eco2": 400 + i % 300,
+            "tvoc": i % 50,
+            "aqi": 1 + i % 3,
+        }
+        store.append(ts, data)
+        rollups.update(ts, data)
+    yield store, rollups, timestamps
+    store.close()
+
+
+def assert_same(rolled, raw):
+    assert [r["timestamp"] for r in rolled] == [r["timestamp"] for r in raw]
+    for a, b in zip(rolled, raw):
+        for name, value in b.items():
+            if name != "timestamp":
+                assert a[name] == pytest.approx(value, rel=1e-3, abs=1e-3), name
+
+
+def compare(store, rollups, **kwargs):
+    """Runs a query with rollups and the same query, at the bucket it settled on, over raw samples."""
+    rolled, meta = run_query(store, rollups=rollups, **kwargs)
+    raw, _ = run_query(store, **{**kwargs, "bucket": f"{meta['bucket']}s"})
+    assert_same(rolled, raw)
+    return meta
+
+
+@pytest.mark.parametrize("agg", ["count", "mean", "std", "min", "max"])
+def test_rollup_matches_raw_with_unaligned_edges(history, agg):
+    store, rollups, timestamps = history
+    meta = compare(store, rollups, start=str(int(timestamps[0]) + 3034), end=str(int(timestamps[-1]) - 777),
+                   bucket="1h", agg=agg)
+    assert meta.get("resolution") == 3600
+
+
+def test_long_view_is_served_from_rollups(history):
+    store, rollups, timestamps = history
+    meta = compare(store, rollups, start=str(int(timestamps[-1]) - 30 * 86400), bucket="1m", agg="mean")
+    assert meta.get("resolution") == 3600
+    meta = compare(store, rollups, bucket="1m", agg="count")
+    assert meta.get("resolution") == 3600
+
+
+def test_short_range_inside_one_bucket(history):
+    store, rollups, timestamps = history
+    compare(store, rollups, start=str(int(timestamps[100])), end=str(int(timestamps[110])), bucket="1h", agg="count")
+
+
+def test_raw_query_limit_and_fields(history):
+    store, _, timestamps = history
+    data, _ = run_query(store, start=str(int(timestamps[10])), fields="eco2", limit=5)
+    assert len(data) == 5
+    assert set(data[0]) == {"timestamp", "eco2"}
@@ -0,0 +1,55 @@
+import json
+import queue
+from utils.serial_reader import DROP_NEWEST, DROP_OLDEST, LineFramer, parse_frame, put_with_policy
+
+GOOD = {"temperature": 23.1, "humidity": 45.2, "eco2": 612, "tvoc": 48, "aqi": 1}
+
+
+def frame(data=GOOD):
+    return json.dumps(data).encode()
+
+
+def test_framer_reassembles_split_lines():
+    framer = LineFramer()
+    assert framer.feed(b'{"a": 1}\r\n{"b"') == [b'{"a": 1}']
+    assert framer.feed(b": 2}\n\n") == [b'{"b": 2}']
+    assert framer.buffer == bytearray()
+
+
+def test_framer_resynchronises_after_overflow():
+    framer = LineFramer(max_frame=16)
+    assert framer.feed(b"x" * 40) == []
+    assert framer.overflows == 1
+    assert framer.feed(b"tail\n" + frame() + b"\n") == [b"tail", frame()]
+
+
+def test_parse_frame_recovers_from_leading_garbage():
+    assert parse_frame(frame()) == GOOD
+    assert parse_frame(b'{"temperature": 23.1, "humid' + frame()) == GOOD
+    assert parse_frame(b"\xff\xfe\x00" + frame()) == GOOD
+
+
+def test_parse_frame_rejects_invalid_readings():
+    assert parse_frame(b"ets Jun  8 2016 00:22:57 rst:0x1 (POWERON_RESET)") is None
+    assert parse_frame(b'{"temperature": }') is None
+    assert parse_frame(b"[1, 2]") is None
+    assert parse_frame(frame({**GOOD, "temperature": None})) is None
+    assert parse_frame(frame({**GOOD, "eco2": True})) is None
+    assert parse_frame(frame({**GOOD, "tvoc": 2 ** 40})) is None
+    assert parse_frame(b'{"temperature": NaN, "humidity": 1, "eco2": 1, "tvoc": 1, "aqi": 1}') is None
+    assert parse_frame(frame({k: v for k, v in GOOD.items() if k != "aqi"})) is None
+
+
+def test_parse_frame_coerces_column_types():
+    data = parse_frame(frame({**GOOD, "temperature": 23, "eco2": 612.6}))
+    assert data["temperature"] == 23.0 and isinstance(data["temperature"], float)
+    assert data["eco2"] == 613 and isinstance(data["eco2"], int)
+
+
+def test_put_with_policy():
+    q = queue.Queue(maxsize=2)
+    assert not put_with_policy(q, 1, DROP_OLDEST)
+    assert not put_with_policy(q, 2, DROP_OLDEST)
+    assert put_with_policy(q, 3, DROP_OLDEST)
+    assert put_with_policy(q, 4, DROP_NEWEST)
+    assert [q.get_nowait(), q.get_nowait()] == [2, 3]
@@ -0,0 +1,35 @@
+import time
+from utils.config import load_config
+from utils.ingest import build_hub
+from utils.history_query import run_query
+
+
+def test_simulated_device_end_to_end(tmp_path):
+    """Feeds a sim: port with malformed frames through the hub into the history store."""
+    count = 200
+    spec = f"sim:room1?rate=500&malformed=0.1&seed=3&count={count}"
+    hub = build_hub(load_config(["--serial", spec, "--data-dir", str(tmp_path), "--rescan-interval", "3600",
+                                 "--filter", "off"]))
+    hub.start()
+    try:
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            hub.consume(timeout=0.1)
+            stats = hub.stats()["devices"].get("room1")
+            if stats and stats["lines"] >= count and hub.queue.empty():
+                break
+        assert hub.device_ids() == ["room1"]
+        stats = hub.stats()["devices"]["room1"]
+        esp32 = hub.get("room1")
+    finally:
+        hub.stop()
+
+    assert stats["lines"] == count
+    assert 0 < stats["parse_errors"] < count
+    stored = len(esp32.store)
+    assert stored == count - stats["parse_errors"]
+    assert esp32.latest.seq > 0
+
+    data, _ = run_query(esp32, limit=10)
+    assert len(data) == 10
+    assert set(data[-1]) >= {"timestamp", "temperature", "humidity", "eco2", "tvoc", "aqi"}
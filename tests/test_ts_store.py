@@ -0,0 +1,64 @@
+import numpy as np
+from utils.ts_store import TimeSeriesStore
+
+
+def reading(i):
+    return {"temperature": 20.0 + i / 10, "humidity": 40.0, "eco2": 400 + i, "tvoc": i, "aqi": 1}
+
+
+def fill(path, timestamps, segment_records=4):
+    store = TimeSeriesStore(path, segment_records=segment_records)
+    for i, ts in enumerate(timestamps):
+        store.append(ts, reading(i))
+    return store
+
+
+def test_reopen_keeps_sealed_and_active_segments(tmp_path):
+    store = fill(tmp_path, range(100, 110))
+    store.close()
+
+    reopened = TimeSeriesStore(tmp_path, segment_records=4)
+    assert len(reopened) == 10
+    assert reopened.time_range() == (100, 109)
+    reopened.append(110, reading(10))
+    assert reopened.tail(2)["timestamp"].tolist() == [109, 110]
+    reopened.close()
+
+
+def test_reopen_drops_torn_record(tmp_path):
+    store = fill(tmp_path, range(100, 106))
+    store.close()
+    active = sorted(tmp_path.glob("seg-*.bin"))[-1]
+    with open(active, "ab") as f:
+        f.write(b"\x00" * 5)
+
+    reopened = TimeSeriesStore(tmp_path, segment_records=4)
+    assert len(reopened) == 6
+    assert reopened.time_range() == (100, 105)
+    reopened.close()
+
+
+def test_query_ranges_across_segments(tmp_path):
+    timestamps = list(range(1000, 1100, 5))
+    store = fill(tmp_path, timestamps)
+
+    columns = store.query(1012, 1047)
+    assert columns["timestamp"].tolist() == [t for t in timestamps if 1012 <= t <= 1047]
+    assert columns["eco2"].tolist() == [400 + timestamps.index(t) for t in columns["timestamp"]]
+    assert store.query(1047, 1012)["timestamp"].size == 0
+    assert store.query(2000)["timestamp"].size == 0
+    assert store.query(end_ts=1010)["timestamp"].tolist() == [1000, 1005, 1010]
+    assert store.query(1000, 1095, limit=3)["timestamp"].tolist() == [1085, 1090, 1095]
+    store.close()
+
+
+def test_readonly_follows_writer(tmp_path):
+    writer = fill(tmp_path, range(100, 103))
+    reader = TimeSeriesStore(tmp_path, readonly=True)
+    assert len(reader) == 3
+
+    for i, ts in enumerate(range(103, 110)):
+        writer.append(ts, reading(i))
+    assert reader.time_range() == (100, 109)
+    np.testing.assert_array_equal(reader.query()["timestamp"], writer.query()["timestamp"])
+    writer.close()
@@ -0,0 +1,153 @@
+import numpy as np
+from utils.ring_buffer import FIELD_NAMES
+
+# (health low, comfort low, comfort high, health high) per field; None means no bound.
+# eCO2, TVOC and AQI follow the ENS160 rating bands ("good" ends at the comfort
+# limit, "poor" starts at the health limit).
+THRESHOLDS = {
+    "temperature": (16.0, 20.0, 26.0, 30.0),
+    "humidity": (20.0, 30.0, 60.0, 70.0),
+    "eco2": (None, None, 1000, 1500),
+    "tvoc": (None, None, 220, 660),
+    "aqi": (None, None, 2, 3),
+}
+# Largest normal change per minute, used for both the window trend and short-term jumps.
+RATE_LIMITS = {"temperature": 0.3, "humidity": 2.0, "eco2": 50, "tvoc": 30, "aqi": 0.5}
+UNITS = {"temperature": "C", "humidity": "%", "eco2": "ppm", "tvoc": "ppb", "aqi": ""}
+LABELS = {"temperature": "temperature", "humidity": "humidity", "eco2": "eCO2", "tvoc": "TVOC", "aqi": "AQI"}
+
+
+def _format(field, value):
+    unit = UNITS[field]
+    number = f"{value:.1f}" if isinstance(value, float) and not float(value).is_integer() else f"{value:g}"
+    return f"{number} {unit}".rstrip() if unit != "%" else f"{number}%"
+
+
+class AirQualityAnalyzer:
+    def __init__(self, thresholds=THRESHOLDS, rate_limits=RATE_LIMITS, window=900, rate_window=60, horizon=30):
+        """Rule engine that triages readings before they reach the RAG service.
+
+        Checks the latest reading against comfort and health `thresholds`,
+        fits a least-squares trend over the last `window` seconds of history,
+        flags jumps faster than `rate_limits` over `rate_window` seconds and
+        warns when the trend crosses a comfort limit within `horizon` minutes.
+        Everything is computed on all fields at once with NumPy.
+        """
+        self.fields = [field for field in FIELD_NAMES if field in thresholds]
+        self.window = window
+        self.rate_window = rate_window
+        self.horizon = horizon
+        # (fields, 4) bounds with NaN where a field has no bound; comparisons with NaN are False.
+        self.bounds = np.array([[np.nan if b is None else b for b in thresholds[f]] for f in self.fields], dtype=np.float64)
+        self.rate_limits = np.array([rate_limits.get(f, np.inf) for f in self.fields], dtype=np.float64)
+
+    def _levels(self, values):
+        """Returns the findings for values outside their comfort or health range."""
+        health_low, comfort_low, comfort_high, health_high = self.bounds.T
+        severity = np.select(
+            [values < health_low, values > health_high, values < comfort_low, values > comfort_high],
+            ["health", "health", "comfort", "comfort"], default="")
+        direction = np.where((values < comfort_low) | (values < health_low), "low", "high")
+        limit = np.select(
+            [values < health_low, values > health_high, values < comfort_low],
+            [health_low, health_high, comfort_low], default=comfort_high)
+        return [
+            {"field": self.fields[i], "kind": "level", "severity": str(severity[i]), "direction": str(direction[i]),
+             "value": float(values[i]), "limit": float(limit[i])}
+            for i in np.flatnonzero(severity != "")
+        ]
+
+    def _trends(self, values, timestamps, matrix):
+        """Returns trend, jump and projected-crossing findings from the history window."""
+        findings = []
+        t = timestamps.astype(np.float64)
+        if len(t) < 3 or t[-1] - t[0] < self.rate_window:
+            return findings
+
+        # Least-squares slope of every field at once, in units per minute.
+        tc = t - t.mean()
+        slopes = tc @ (matrix - matrix.mean(axis=0)) / (tc @ tc) * 60
+
+        # Change over the trailing rate_window seconds, for every sample at once.
+        back = np.searchsorted(t, t - self.rate_window, side="left")
+        elapsed = t - t[back]
+        usable = elapsed >= self.rate_window / 2
+        jumps = np.zeros(len(self.fields))
+        if usable.any():
+            rates = (matrix[usable] - matrix[back[usable]]) / elapsed[usable, None] * 60
+            jumps = rates[np.argmax(np.abs(rates), axis=0), np.arange(len(self.fields))]
+
+        for i in np.flatnonzero(np.abs(slopes) > self.rate_limits):
+            findings.append({"field": self.fields[i], "kind": "trend", "direction": "rising" if slopes[i] > 0 else "falling",
+                             "per_minute": round(float(slopes[i]), 2), "minutes": round((t[-1] - t[0]) / 60, 1)})
+        for i in np.flatnonzero(np.abs(jumps) > 2 * self.rate_limits):
+            findings.append({"field": self.fields[i], "kind": "jump", "direction": "rising" if jumps[i] > 0 else "falling",
+                             "per_minute": round(float(jumps[i]), 2)})
+
+        # Minutes until the current trend leaves the comfort range.
+        _, comfort_low, comfort_high, _ = self.bounds.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            target = np.where(slopes > 0, comfort_high, comfort_low)
+            eta = (target - values) / slopes
+        inside = ~((values < comfort_low) | (values > comfort_high))
+        for i in np.flatnonzero(inside & (eta > 0) & (eta <= self.horizon)):
+            findings.append({"field": self.fields[i], "kind": "forecast", "direction": "high" if slopes[i] > 0 else "low",
+                             "limit": float(target[i]), "minutes": round(float(eta[i]), 1)})
+        return findings
+
+    def analyze(self, data, history=None):
+        """Analyzes the latest reading plus optional history columns (as returned by Esp32.query).
+
+        Returns {"status": "normal" | "abnormal", "values": ..., "findings": [...]}.
+        """
+        values = np.array([float(data.get(field, 0) or 0) for field in self.fields])
+        findings = self._levels(values)
+        if history is not None and len(history["timestamp"]):
+            timestamps = history["timestamp"]
+            if self.window:
+                timestamps = timestamps[timestamps >= timestamps[-1] - self.window]
+            n = len(timestamps)
+            matrix = np.column_stack([history[field][-n:].astype(np.float64) for field in self.fields])
+            findings += self._trends(values, timestamps, matrix)
+        return {
+            "status": "abnormal" if findings else "normal",
+            "values": {field: data.get(field, 0) for field in self.fields},
+            "findings": findings,
+        }
+
+
+def signature(report):
+    """A hashable summary of the findings, for caching advice per distinct situation."""
+    return tuple(sorted((f["field"], f["kind"], f.get("severity", ""), f["direction"]) for f in report["findings"]))
+
+
+def describe(finding):
+    field = finding["field"]
+    label = LABELS[field]
+    if finding["kind"] == "level":
+        side = "below" if finding["direction"] == "low" else "above"
+        return f"{label} {_format(field, finding['value'])} is {side} the {finding['severity']} limit {_format(field, finding['limit'])}"
+    if finding["kind"] == "trend":
+        return f"{label} {finding['direction']} {abs(finding['per_minute']):g} {UNITS[field]}/min over the last {finding['minutes']:g} min"
+    if finding["kind"] == "jump":
+        return f"{label} changed sharply ({finding['per_minute']:+g} {UNITS[field]}/min)"
+    return f"{label} will reach {_format(field, finding['limit'])} in about {finding['minutes']:g} min at the current trend"
+
+
+def summary_prompt(report):
+    """Builds a compact RAG prompt that only spells out the abnormal findings."""
+    flagged = {f["field"] for f in report["findings"]}
+    normal = [f"{LABELS[field]} {_format(field, value)}" for field, value in report["values"].items() if field not in flagged]
+    lines = ["Indoor air check (ENS160 sensor). Abnormal findings:"]
+    lines += [f"- {describe(finding)}" for finding in report["findings"]]
+    if normal:
+        lines.append(f"Normal: {', '.join(normal)}.")
+    lines.append("For each finding, give its known consequences (from the vector database if found) and actionable "
+                 "recommendations such as opening a window, running the humidifier or purifier fan, or vacuuming.")
+    return "\n".join(lines)
+
+
+def normal_answer(report):
+    """The instant answer for a reading where nothing needs attention."""
+    values = ", ".join(f"{LABELS[field]} {_format(field, value)}" for field, value in report["values"].items())
+    return f"All readings are within the comfortable range and stable ({values}). No action is needed right now."
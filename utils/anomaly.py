@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+from collections import deque
+import numpy as np
+from utils.fileio import atomic_write
+from utils.ring_buffer import FIELD_NAMES, format_timestamp
+
+# Spread below which a field is considered flat, so tiny wiggles on a steady
+# signal do not produce huge scores.
+MIN_STD = {"temperature": 0.05, "humidity": 0.2, "eco2": 5, "tvoc": 3, "aqi": 0.5}
+# Seconds a field may repeat the exact same value before it is reported stuck;
+# None disables the check (AQI is a 1-5 index that legitimately sits still).
+STUCK_SECONDS = {"temperature": 900, "humidity": 900, "eco2": 1800, "tvoc": 1800, "aqi": None}
+# Values the ENS160 settles on in clean air; a field resting here is not stuck.
+FLOORS = {"eco2": 400, "tvoc": 0}
+
+
+class AnomalyDetector:
+    def __init__(self, alpha=0.05, z_threshold=4.0, window=31, mad_threshold=5.0, warmup=30,
+                 min_std=MIN_STD, stuck_seconds=STUCK_SECONDS, floors=FLOORS):
+        """Online fault and spike detector for one device.
+
+        State is a fixed set of per-field arrays: an exponentially weighted
+        mean and variance (smoothing `alpha`), a `window`-sample ring for the
+        rolling median and MAD, and the time each field last changed. A
+        reading is a spike when it is more than `z_threshold` EWMA standard
+        deviations from the mean and more than `mad_threshold` robust
+        deviations from the rolling median. A field repeating the same value
+        for `stuck_seconds` is reported stuck. Each condition is reported once
+        when it starts, not on every sample while it lasts.
+        """
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.mad_threshold = mad_threshold
+        self.warmup = warmup
+        self.min_std = np.array([min_std.get(f, 0.0) for f in FIELD_NAMES], dtype=np.float64)
+        self.stuck_seconds = np.array([np.inf if stuck_seconds.get(f) is None else stuck_seconds[f] for f in FIELD_NAMES])
+        self.floors = np.array([floors.get(f, np.nan) for f in FIELD_NAMES], dtype=np.float64)
+
+        n = len(FIELD_NAMES)
+        self.count = 0
+        self.mean = np.zeros(n)
+        self.var = np.zeros(n)
+        self.window = np.zeros((window, n))
+        self.last_value = np.full(n, np.nan)
+        self.last_change = np.zeros(n)
+        self.spiking = np.zeros(n, dtype=bool)
+        self.stuck = np.zeros(n, dtype=bool)
+
+        self.events = 0
+
+    def feed(self, timestamp, data):
+        """Scores one reading and returns the anomaly events it starts, usually none."""
+        x = np.array([float(data.get(name, 0) or 0) for name in FIELD_NAMES])
+        events = []
+
+        if self.count >= self.warmup:
+            std = np.maximum(np.sqrt(self.var), self.min_std)
+            z = np.abs(x - self.mean) / std
+            spiking = z > self.z_threshold
+            if spiking.any():
+                # The median/MAD confirmation is only needed when the cheap EWMA test fires.
+                filled = self.window[:min(self.count, len(self.window))]
+                median = np.median(filled, axis=0)
+                mad = np.median(np.abs(filled - median), axis=0)
+                robust = np.abs(x - median) / np.maximum(1.4826 * mad, self.min_std)
+                spiking &= robust > self.mad_threshold
+                for i in np.flatnonzero(spiking & ~self.spiking):
+                    events.append(self._event(timestamp, i, "spike", x[i], expected=round(float(median[i]), 3),
+                                              z=round(float(z[i]), 2), robust_z=round(float(robust[i]), 2)))
+            self.spiking = spiking
+
+        # Welford-style exponentially weighted mean and variance.
+        diff = x - self.mean if self.count else np.zeros_like(x)
+        if not self.count:
+            self.mean = x.copy()
+        increment = self.alpha * diff
+        self.mean += increment
+        self.var = (1 - self.alpha) * (self.var + diff * increment)
+        self.window[self.count % len(self.window)] = x
+        self.count += 1
+
+        changed = x != self.last_value
+        self.last_change[changed] = timestamp
+        self.last_value = x
+        stuck = ~changed & (timestamp - self.last_change >= self.stuck_seconds) & (x != self.floors)
+        for i in np.flatnonzero(stuck & ~self.stuck):
+            events.append(self._event(timestamp, i, "stuck", x[i], seconds=int(timestamp - self.last_change[i])))
+        self.stuck = stuck
+
+        self.events += len(events)
+        return events
+
+    def _event(self, timestamp, i, kind, value, **details):
+        value = float(value)
+        return {"field": FIELD_NAMES[i], "kind": kind, "value": int(value) if value.is_integer() else round(value, 3),
+                "epoch": round(float(timestamp), 3), "timestamp": format_timestamp(timestamp), **details}
+
+    def stats(self):
+        return {
+            "samples": self.count,
+            "events": self.events,
+            "spiking": [name for name, flag in zip(FIELD_NAMES, self.spiking) if flag],
+            "stuck": [name for name, flag in zip(FIELD_NAMES, self.stuck) if flag],
+        }
+
+
+class AnomalyLog:
+    def __init__(self, path=None, maxlen=500, readonly=False):
+        """The most recent `maxlen` anomaly events of one device.
+
+        With `path` events are also appended to a JSON-lines file, which is
+        compacted back to `maxlen` lines once it holds twice that many. A
+        `readonly` log reads a file written by another process and reloads it
+        whenever it changes.
+        """
+        self.path = path
+        self.maxlen = maxlen
+        self.readonly = readonly
+        self.events = deque(maxlen=maxlen)
+        self.lines = 0
+        self.stamp = None
+        self.lock = threading.Lock()
+        if path is not None and not readonly:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if self.path is None:
+            return
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self.stamp:
+            return
+        events = deque(maxlen=self.maxlen)
+        lines = 0
+        with open(self.path) as f:
+            for line in f:
+                lines += 1
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    pass  # a line still being written by the ingest process
+        self.events, self.lines, self.stamp = events, lines, stamp
+
+    def append(self, event):
+        with self.lock:
+            self.events.append(event)
+            if self.path is None:
+                return
+            if self.lines >= 2 * self.maxlen:
+                atomic_write(self.path, "".join(json.dumps(e) + "\n" for e in self.events))
+                self.lines = len(self.events)
+            else:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(event) + "\n")
+                self.lines += 1
+
+    def recent(self, limit=None, since=None):
+        """Returns events newest last, optionally only those after epoch `since`."""
+        with self.lock:
+            if self.readonly:
+                self._load()
+            events = list(self.events)
+        if since is not None:
+            events = [e for e in events if e["epoch"] > since]
+        if limit is not None:
+            events = events[-limit:] if limit > 0 else []
+        return events
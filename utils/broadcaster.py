@@ -0,0 +1,94 @@
+import json
+import threading
+from collections import deque
+
+
+class Subscription:
+    def __init__(self, broadcaster, topic=None, max_buffer=64):
+        """One subscriber's bounded buffer of pre-encoded events."""
+        self.broadcaster = broadcaster
+        self.topic = topic
+        self.max_buffer = max_buffer
+        self.events = deque()
+        self.ready = threading.Condition(threading.Lock())
+        self.closed = False
+        self.evicted = False
+
+    def offer(self, event):
+        """Buffers an event. Returns False if the subscriber is too far behind and must be evicted."""
+        with self.ready:
+            if self.closed:
+                return False
+            if len(self.events) >= self.max_buffer:
+                self.closed = self.evicted = True
+                self.events.clear()
+                self.ready.notify()
+                return False
+            self.events.append(event)
+            self.ready.notify()
+            return True
+
+    def get(self, timeout=None):
+        """Returns the next event bytes, or None on timeout or once the subscription is closed."""
+        with self.ready:
+            if not self.events and not self.closed:
+                self.ready.wait(timeout)
+            if self.events:
+                return self.events.popleft()
+            return None
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        self.broadcaster.unsubscribe(self)
+
+
+class Broadcaster:
+    def __init__(self, max_buffer=64, max_subscribers=1000):
+        """Fans published samples out to subscribers.
+
+        Each sample is encoded to a server-sent event once and the same bytes
+        are handed to every subscriber. A subscriber whose buffer already holds
+        `max_buffer` events is evicted instead of slowing down publishing.
+        """
+        self.max_buffer = max_buffer
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.published = 0
+        self.evictions = 0
+
+    def subscribe(self, topic=None):
+        """Returns a Subscription to every sample, or only to samples published under `topic`."""
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                raise RuntimeError("Too many stream subscribers")
+            subscription = Subscription(self, topic, self.max_buffer)
+            self.subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, data, topic=None, event="sample"):
+        """Encodes `data` once and offers it to every matching subscriber."""
+        with self.lock:
+            self.seq += 1
+            payload = f"id: {self.seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode()
+            subscribers = list(self.subscribers)
+        self.published += 1
+
+        for subscription in subscribers:
+            if subscription.topic is not None and subscription.topic != topic:
+                continue
+            if not subscription.offer(payload) and subscription.evicted:
+                self.evictions += 1
+                self.unsubscribe(subscription)
+
+    def stats(self):
+        with self.lock:
+            subscribers = len(self.subscribers)
+        return {"subscribers": subscribers, "published": self.published, "evictions": self.evictions}
@@ -0,0 +1,94 @@
+import argparse
+import os
+from utils.ring_buffer import FIELD_NAMES
+
+ENV_PREFIX = "DESIOT_"
+FILTERS = ("deadband", "swinging_door", "off")
+
+# name -> (default, help). Every option can also be set as DESIOT_<NAME>.
+OPTIONS = {
+    "host": ("0.0.0.0", "HTTP bind address"),
+    "port": (5000, "HTTP port"),
+    "workers": (2, "HTTP worker processes"),
+    "threads": (8, "threads per HTTP worker"),
+    "max_streams": (0, "open /sensor/stream and /chat/stream responses per web worker, each holds a thread; 0: half of --threads"),
+    "server": ("auto", "HTTP server: auto, gunicorn, waitress or flask"),
+    "role": ("all", "all (ingest process + web workers), ingest or web"),
+    "serial": ("auto", "comma separated serial devices or simulated ports (sim:, replay:, pty:), or auto to discover every ESP32"),
+    "baudrate": (115200, "serial baud rate"),
+    "rescan_interval": (5, "seconds between serial port rescans"),
+    "cache_size": (100, "in-memory readings kept per device"),
+    "filter": ("deadband", "what gets stored: deadband, swinging_door or off (every reading)"),
+    "deadband": ("", "per-field deadbands (swinging_door: deviations), e.g. temperature=0.1,eco2=10; unset fields keep their default"),
+    "deadband_relative": ("", "per-field relative deadbands as fractions of the last stored value, e.g. eco2=0.02"),
+    "max_silence": (300, "store a reading at least this often (seconds), even when nothing changed"),
+    "data_dir": ("data", "directory for history, rollups, latest snapshots and the uplink spool"),
+    "webhook_url": ("http://10.143.202.13:5678/webhook/desiotone/ragchat", "n8n RAG webhook URL"),
+    "thingspeak_channel_id": ("", "ThingSpeak channel id, empty disables the uplink"),
+    "thingspeak_device": ("", "device whose readings go to the ThingSpeak channel; empty: the only attached device, nothing while several are attached"),
+    "thingspeak_write_api_key": ("E45QIV0OXGFP2V90", "ThingSpeak write API key"),
+    "debug": (False, "Flask debug mode (flask server only)"),
+    "log_level": ("INFO", "DEBUG, INFO, WARNING or ERROR; DEBUG logs every stored reading"),
+    "log_format": ("text", "text or json (one JSON object per line)"),
+    "log_sample_seconds": (10.0, "log at most one stored reading per device this often, 0 logs all"),
+    "profiling": (False, "enable the sampling profiler (/debug/profile, SIGUSR2 in the ingest process)"),
+}
+
+
+def _parse_bool(value):
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+def build_parser():
+    """Builds the CLI parser; defaults come from DESIOT_* environment variables when set."""
+    parser = argparse.ArgumentParser(description="Desiot1 ESP32 collector and RAG API")
+    for name, (default, help_text) in OPTIONS.items():
+        env = os.environ.get(ENV_PREFIX + name.upper())
+        flag = "--" + name.replace("_", "-")
+        if isinstance(default, bool):
+            value = _parse_bool(env) if env is not None else default
+            parser.add_argument(flag, dest=name, action=argparse.BooleanOptionalAction, default=value, help=help_text)
+        else:
+            kind = type(default)
+            value = kind(env) if env is not None else default
+            parser.add_argument(flag, dest=name, type=kind, default=value, help=f"{help_text} (default: {value})")
+    return parser
+
+
+def load_config(argv=None):
+    """Returns the configuration from `argv` (None: no CLI arguments) layered over the environment."""
+    config = build_parser().parse_args([] if argv is None else argv)
+    if config.role not in ("all", "ingest", "web"):
+        raise ValueError(f"Unknown role '{config.role}'")
+    if config.filter not in FILTERS:
+        raise ValueError(f"Unknown filter '{config.filter}'. Available: {', '.join(FILTERS)}")
+    field_values(config.deadband)
+    field_values(config.deadband_relative)
+    return config
+
+
+def export_config(config):
+    """Writes `config` back to DESIOT_* variables so child processes and workers load the same values."""
+    for name in OPTIONS:
+        os.environ[ENV_PREFIX + name.upper()] = str(getattr(config, name))
+
+
+def serial_ports(config):
+    """Returns the configured device paths, or None to discover ports automatically."""
+    if config.serial == "auto":
+        return None
+    return [port.strip() for port in config.serial.split(",") if port.strip()]
+
+
+def field_values(value):
+    """Parses "temperature=0.1,eco2=10" into {field: float}; returns None for an empty value."""
+    if not value:
+        return None
+    values = {}
+    for item in value.split(","):
+        name, sep, number = item.partition("=")
+        name = name.strip()
+        if not sep or name not in FIELD_NAMES:
+            raise ValueError(f"Expected field=value pairs for {', '.join(FIELD_NAMES)}, got '{item.strip()}'")
+        values[name] = float(number)
+    return values
@@ -0,0 +1,127 @@
+from utils.ring_buffer import FIELD_NAMES
+
+# Changes smaller than these (in sensor units) are treated as noise.
+DEFAULT_ABSOLUTE = {"temperature": 0.1, "humidity": 0.5, "eco2": 10, "tvoc": 5, "aqi": 0}
+
+
+class DeadbandFilter:
+    def __init__(self, absolute=None, relative=None, max_silence=300, swinging_door=False):
+        """Decides which readings are worth storing and uploading.
+
+        In deadband mode a reading passes when any field moved by more than
+        its `absolute` deadband or by more than its `relative` fraction of the
+        last stored value. With `swinging_door` the absolute deadbands become
+        the compression deviation of a swinging-door trend: readings are held
+        back until a straight line from the last archived point can no longer
+        describe every field within its deviation, and then the last held
+        reading is archived. In both modes a reading is passed at least every
+        `max_silence` seconds as a heartbeat.
+        """
+        self.absolute = dict(DEFAULT_ABSOLUTE if absolute is None else absolute)
+        self.relative = dict(relative or {})
+        self.max_silence = max_silence
+        self.swinging_door = swinging_door
+
+        self.last_values = None  # values of the last passed reading
+        self.last_time = None
+        self.held = None  # swinging door: most recent reading not yet archived
+        self.upper = {}
+        self.lower = {}
+
+        self.received = 0
+        self.passed = 0
+
+    def _values(self, data):
+        return {name: float(data.get(name, 0) or 0) for name in FIELD_NAMES}
+
+    def _changed(self, values):
+        for name, value in values.items():
+            delta = abs(value - self.last_values[name])
+            if delta > self.absolute.get(name, 0):
+                return True
+            if name in self.relative and delta > self.relative[name] * abs(self.last_values[name]):
+                return True
+        return False
+
+    def _archive(self, timestamp, values):
+        self.last_time = timestamp
+        self.last_values = values
+        self.upper = {name: float("-inf") for name in FIELD_NAMES}
+        self.lower = {name: float("inf") for name in FIELD_NAMES}
+        self.passed += 1
+
+    def feed(self, timestamp, data):
+        """Returns the (timestamp, data) readings that should go downstream, possibly none."""
+        self.received += 1
+        values = self._values(data)
+
+        if self.last_values is None:
+            self._archive(timestamp, values)
+            return [(timestamp, data)]
+
+        if not self.swinging_door:
+            if self._changed(values) or timestamp - self.last_time >= self.max_silence:
+                self._archive(timestamp, values)
+                return [(timestamp, data)]
+            return []
+
+        return self._swinging_door(timestamp, data, values)
+
+    def keep(self, timestamp, data):
+        """Passes a reading regardless of the deadband, e.g. one flagged as an anomaly.
+
+        A held swinging-door reading is archived first so the stored trend
+        still leads up to the forced one.
+        """
+        self.received += 1
+        out = []
+        if self.held is not None and self.last_time is not None and self.held[0] > self.last_time:
+            held_time, held_data, held_values = self.held
+            self._archive(held_time, held_values)
+            out.append((held_time, held_data))
+        self.held = None
+        self._archive(timestamp, self._values(data))
+        out.append((timestamp, data))
+        return out
+
+    def _swinging_door(self, timestamp, data, values):
+        dt = timestamp - self.last_time
+        if dt <= 0:
+            # Same second as the archived point: nothing to fit a slope to.
+            self.held = (timestamp, data, values)
+            return []
+
+        door_open = False
+        for name, value in values.items():
+            deviation = self.absolute.get(name, 0)
+            origin = self.last_values[name]
+            self.upper[name] = max(self.upper[name], (value - deviation - origin) / dt)
+            self.lower[name] = min(self.lower[name], (value + deviation - origin) / dt)
+            if self.upper[name] > self.lower[name]:
+                door_open = True
+
+        if not door_open and dt < self.max_silence:
+            self.held = (timestamp, data, values)
+            return []
+
+        out = []
+        if door_open and self.held is not None and self.held[0] > self.last_time:
+            # The trend broke at the previous reading: archive it and restart
+            # the doors from there with the current reading.
+            held_time, held_data, held_values = self.held
+            self._archive(held_time, held_values)
+            out.append((held_time, held_data))
+            self.held = None
+            return out + self._swinging_door(timestamp, data, values)
+
+        self._archive(timestamp, values)
+        self.held = None
+        out.append((timestamp, data))
+        return out
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "passed": self.passed,
+            "compression_ratio": round(self.received / self.passed, 3) if self.passed else None,
+        }
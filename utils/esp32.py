@@ -1,133 +1,230 @@
 import serial
 import serial.tools.list_ports # <-- FIX: Import the tool to list ports
 from datetime import datetime
-import numpy as np
-import json
-import requests
+import time
+from utils.serial_reader import parse_frame
+from utils.snapshot import Snapshot, SEQUENCE, write_snapshot
+from utils.ring_buffer import RingBuffer, TIMESTAMP_FORMAT, columns_to_records
+from utils.sim_serial import open_transport, transport_id
+from utils.log import get_logger, fields, setup_logging, Sampler
+
+log = get_logger("esp32")
+STORED_FORMAT = "Stored -> Temp: %.1fC, Hum: %.1f%%, eCO2: %sppm, TVOC: %sppb, AQI: %s"
+
+# Common VID/PID for ESP32 USB-to-Serial chips
+# CP210x: VID=0x10C4, PID=0xEA60
+# CH340:  VID=0x1A86, PID=0x7523
+# Native USB CDC (ESP32-S2/S3/C3, shows up as /dev/ttyACM*): VID=0x303A, PID=0x1001
+ESP32_IDENTIFIERS = [
+    (0x10C4, 0xEA60),
+    (0x1A86, 0x7523),
+    (0x303A, 0x1001),
+]
+
+
+def find_esp32_ports():
+    """Returns every serial port whose VID/PID matches a known ESP32 bridge, sorted by device name."""
+    matches = []
+    for port in serial.tools.list_ports.comports():
+        # Check if the port's VID and PID match any of our known identifiers
+        if (port.vid, port.pid) in ESP32_IDENTIFIERS:
+            log.debug("Found device with VID=%s, PID=%s on port %s", port.vid, port.pid, port.device)
+            matches.append(port)
+    return sorted(matches, key=lambda port: port.device)
+
+
+def device_id_for(port):
+    """Returns a stable id for a ListPortInfo: the USB serial number when known, else the device name."""
+    if port.serial_number:
+        return port.serial_number
+    return port.device.rsplit("/", 1)[-1]
+
 
 class Esp32:
     # <-- FIX: Corrected the special method name from _init_ to __init__
-    def __init__(self, port="auto", baudrate=115200, timeout=1, cache_size=100):
-        """Initializes the serial connection."""
+    def __init__(self, port="auto", baudrate=115200, timeout=1, cache_size=100, store=None, rollups=None, device_id=None, uplink=None, filter=None, broadcaster=None, latest_path=None, detector=None, anomalies=None, log_sample_interval=10.0):
+        """Initializes the serial connection.
+
+        `port` is a device path, "auto", or a simulated port spec from
+        utils.sim_serial (sim:, replay: or pty:) that is served through a
+        pseudo-terminal, so the real serial code path runs without hardware.
+        Stored readings are logged at most once per `log_sample_interval`
+        seconds at INFO, and every one of them at DEBUG.
+        """
         if port == "auto":
             port = self.find_esp32_port()
             if not port:
                 raise ValueError("No ESP32 device found. Please check the USB connection and ensure drivers are installed.")
         self.port = port
+        self.device_id = device_id or transport_id(port)
+        self.transport = open_transport(port)  # utils.sim_serial.PtyTransport for simulated ports
 
         try:
-            self.ser = serial.Serial(self.port, baudrate, timeout=timeout)
-            print(f"Successfully connected to {port}")
+            self.ser = serial.Serial(self.transport.path if self.transport else self.port, baudrate, timeout=timeout)
+            log.info("Successfully connected to %s", port)
         except serial.SerialException as e:
-            print(f"Error connecting to {port}: {e}")
+            log.error("Error connecting to %s: %s", port, e)
             self.ser = None # Set ser to None if connection fails
         
-        self.latest_data_temp = 0.0
-        self.latest_data_humd = 0.0
-        self.latest_data_eco2 = 0
-        self.latest_data_tvoc = 0
-        self.latest_data_aqi = 0
-        self.latest_timestamp = None
+        # Published as one immutable Snapshot so readers never see half of a sample.
+        self.latest = Snapshot(0, {
+            "temperature": 0.0,
+            "humidity": 0.0,
+            "eco2": 0,
+            "tvoc": 0,
+            "aqi": 0,
+            "timestamp": None,
+            "device": self.device_id
+        }, self.device_id)
 
         self.cache_size = cache_size
-        self.cache_temp = np.array([], dtype=dict)
-        
-        self.write_url = "https://api.thingspeak.com/update?api_key=E45QIV0OXGFP2V90"
+        self.history = RingBuffer(cache_size)
+        self.store = store  # optional utils.ts_store.TimeSeriesStore for persistent history
+        self.rollups = rollups  # optional utils.rollup.Rollups updated with every stored reading
+        self.uplink = uplink  # optional utils.thingspeak_uplink.ThingSpeakUplink
+        self.filter = filter  # optional utils.deadband.DeadbandFilter deciding what gets stored
+        self.broadcaster = broadcaster  # optional utils.broadcaster.Broadcaster for /sensor/stream
+        self.latest_path = latest_path  # optional file the latest snapshot is shared through
+        self.detector = detector  # optional utils.anomaly.AnomalyDetector watching every reading
+        self.anomalies = anomalies  # optional utils.anomaly.AnomalyLog of recent anomaly events
+        self.log_sampler = Sampler(log_sample_interval)
+
+    @property
+    def latest_data_temp(self):
+        return self.latest.data["temperature"]
+
+    @property
+    def latest_data_humd(self):
+        return self.latest.data["humidity"]
+
+    @property
+    def latest_data_eco2(self):
+        return self.latest.data["eco2"]
+
+    @property
+    def latest_data_tvoc(self):
+        return self.latest.data["tvoc"]
+
+    @property
+    def latest_data_aqi(self):
+        return self.latest.data["aqi"]
+
+    @property
+    def latest_timestamp(self):
+        return self.latest.data["timestamp"]
 
     def get_latest_data(self):
         """Returns the latest sensor data."""
-        return {
-            "temperature": self.latest_data_temp,
-            "humidity": self.latest_data_humd,
-            "eco2": self.latest_data_eco2,
-            "tvoc": self.latest_data_tvoc,
-            "aqi": self.latest_data_aqi,
-            "timestamp": self.latest_timestamp
-        }
+        return dict(self.latest.data)
     
-    def get_historical_data(self):
-        """Returns historical data. This is a placeholder as the ESP32 does not store historical data."""
-        # In a real application, you might want to implement a way to store and retrieve historical data.
-        return self.cache_temp.tolist()  # Convert numpy array to list for easier handling
+    def get_historical_data(self, last=None):
+        """Returns the most recent readings as a list of dicts, oldest first."""
+        if self.store is not None:
+            return columns_to_records(self.store.tail(last if last is not None else self.cache_size))
+        return self.history.to_records(last)
+
+    def query(self, start_ts=None, end_ts=None, limit=None):
+        """Returns history columns for [start_ts, end_ts], from the store when one is attached."""
+        if self.store is not None:
+            return self.store.query(start_ts, end_ts, limit=limit)
+        return self.history.query(start_ts, end_ts, limit=limit)
+
+    def time_range(self):
+        """Returns the (first, last) timestamps query() can return, or None when there is no history."""
+        if self.store is not None:
+            return self.store.time_range()
+        return self.history.time_range()
 
     def find_esp32_port(self):
         """Scans all available serial ports and returns the one connected to an ESP32."""
-        print("Scanning for ESP32...")
-        ports = serial.tools.list_ports.comports()
-        
-        # Common VID/PID for ESP32 USB-to-Serial chips
-        # CP210x: VID=0x10C4, PID=0xEA60
-        # CH340:  VID=0x1A86, PID=0x7523
-        esp32_identifiers = [
-            (0x10C4, 0xEA60),
-            (0x1A86, 0x7523)
-        ]
-
-        for port in ports:
-            # Check if the port's VID and PID match any of our known identifiers
-            if (port.vid, port.pid) in esp32_identifiers:
-                print(f"Found device with VID={port.vid}, PID={port.pid} on port {port.device}")
-                return port.device # Return the device name, e.g., '/dev/ttyUSB0'
-
-        return None # Return None if no matching device is found
+        log.info("Scanning for ESP32...")
+        ports = find_esp32_ports()
+        return ports[0].device if ports else None # Return None if no matching device is found
 
     def read_data(self):
         # <-- FIX: Check if the serial object was successfully created
         if self.ser and self.ser.isOpen():
-            try:
-                line = self.ser.readline().decode('utf-8').rstrip()
-                if not line:
-                    return
-
-                data = json.loads(line)
-                
-                # Update local data
-                self.latest_data_temp = data.get("temperature", 0.0)
-                self.latest_data_humd = data.get("humidity", 0.0)
-                self.latest_data_eco2 = data.get("eco2", 0)
-                self.latest_data_tvoc = data.get("tvoc", 0)
-                self.latest_data_aqi = data.get("aqi", 0)
-                self.latest_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                data["timestamp"] = self.latest_timestamp
-                
-                print(f"Received -> Temp: {self.latest_data_temp:.1f}C, Hum: {self.latest_data_humd:.1f}%, eCO2: {self.latest_data_eco2}ppm, TVOC: {self.latest_data_tvoc}ppb, AQI: {self.latest_data_aqi}")
-                
-                # Send to ThingSpeak
-                # self.send_data()
-
-                # simple caching
-                if len(self.cache_temp) < self.cache_size:
-                    print(f"Adding data to cache: {data}")
-                    self.cache_temp = np.append(self.cache_temp, data)
-                else:
-                    self.cache_temp = np.roll(self.cache_temp, -1)
-                    self.cache_temp[-1] = data
-
-                return data  # Return the data for further processing if needed
-            except json.JSONDecodeError:
-                # This can happen if the ESP32 sends incomplete data (e.g., during reset)
-                print("Received incomplete or malformed JSON data. Skipping.")
-            except UnicodeDecodeError:
-                print("Received non-UTF-8 data. Skipping.")
-    
-    # def send_data(self):
-    #     """Sends the latest data to ThingSpeak."""
-    #     # ThingSpeak has a rate limit of about 15 seconds.
-    #     # This code sends data every time it's read, so ensure your ESP32 sends data slowly.
-        
-    #     # Construct the URL with all fields
-    #     url = (f"{self.write_url}&field1={self.latest_data_temp:.2f}"
-    #            f"&field2={self.latest_data_humd:.2f}&field3={self.latest_data_eco2}"
-    #            f"&field4={self.latest_data_tvoc}&field5={self.latest_data_aqi}")
+            line = self.ser.readline().strip()
+            if not line:
+                return
+
+            data = parse_frame(line)
+            if data is None:
+                # This can happen if the ESP32 sends incomplete data (e.g., during reset) or a failed sensor read
+                log.warning("Received malformed or incomplete reading. Skipping.", extra=fields(device=self.device_id))
+                return
+            return self.process(time.time(), data)
+
+    def process(self, now, data):
+        """Updates the latest reading and passes the sample through the filter to the cache, store and uplink.
+
+        `data` must be a reading validated by utils.serial_reader.parse_frame.
+        """
+        data["timestamp"] = datetime.fromtimestamp(now).strftime(TIMESTAMP_FORMAT)
+        data["device"] = self.device_id
+
+        # Update local data with a single reference swap
+        self.latest = Snapshot(next(SEQUENCE), {
+            "temperature": data.get("temperature", 0.0),
+            "humidity": data.get("humidity", 0.0),
+            "eco2": data.get("eco2", 0),
+            "tvoc": data.get("tvoc", 0),
+            "aqi": data.get("aqi", 0),
+            "timestamp": data["timestamp"],
+            "device": self.device_id
+        }, self.device_id)
+        if self.latest_path is not None:
+            write_snapshot(self.latest_path, self.latest)
         
-    #     try:
-    #         response = requests.get(url, timeout=5) # Add a timeout
-    #         print(f"ThingSpeak response status: {response.status_code}")
-    #     except requests.exceptions.RequestException as e:
-    #         print(f"Error sending data to ThingSpeak: {e}")
+        # Anomaly events go to the log and the live stream, and the reading
+        # that caused them is always stored.
+        events = self.detector.feed(now, data) if self.detector is not None else []
+        for event in events:
+            event["device"] = self.device_id
+            log.warning("Anomaly -> %s %s: %s", event["kind"], event["field"], event["value"], extra=fields(device=self.device_id))
+            if self.anomalies is not None:
+                self.anomalies.append(event)
+            if self.broadcaster is not None:
+                self.broadcaster.publish(event, topic=self.device_id, event="anomaly")
+
+        # Readings suppressed by the deadband filter only update "latest".
+        if self.filter is None:
+            accepted = [(now, data)]
+        elif events:
+            accepted = self.filter.keep(now, data)
+        else:
+            accepted = self.filter.feed(now, data)
+        for timestamp, sample in accepted:
+            # Logging every reading costs real time at high rates, so INFO only gets a sample.
+            args = (sample.get('temperature', 0.0), sample.get('humidity', 0.0), sample.get('eco2', 0), sample.get('tvoc', 0), sample.get('aqi', 0))
+            suppressed = self.log_sampler.allow()
+            if suppressed is not None:
+                log.info(STORED_FORMAT, *args, extra=fields(device=self.device_id, suppressed=suppressed))
+            else:
+                log.debug(STORED_FORMAT, *args, extra=fields(device=self.device_id))
+
+            # Push to live /sensor/stream subscribers
+            if self.broadcaster is not None:
+                self.broadcaster.publish(sample, topic=self.device_id)
+
+            # Send to ThingSpeak in the background
+            if self.uplink is not None:
+                self.uplink.submit(timestamp, sample)
+
+            # O(1) insert into the preallocated ring buffer
+            self.history.append(int(timestamp), sample)
+            if self.store is not None:
+                self.store.append(int(timestamp), sample)
+            # Rollups fold the same readings as the store, so bucketed answers
+            # agree whether they come from rollups or from raw samples.
+            if self.rollups is not None:
+                self.rollups.update(int(timestamp), sample)
+
+        return data  # Return the data for further processing if needed
 
 # <-- FIX: Corrected the special name from "_main_" to "__main__"
 if __name__ == "__main__":
+    setup_logging()
     # <-- FIX: Call the auto-detection function first
     esp32_port_name = find_esp32_port()
     
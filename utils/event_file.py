@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+
+
+class EventFile:
+    def __init__(self, path, max_bytes=16 * 1024 * 1024):
+        """Appends published events as JSON lines, for web workers in other processes.
+
+        Stands in for a Broadcaster in the ingest process: publish() takes the
+        same arguments, so every accepted sample and anomaly event reaches the
+        workers' /sensor/stream subscribers through EventFollower. Once the
+        file grows past `max_bytes` it is rotated to `path`.1.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file = open(path, "ab")
+        self.published = 0
+
+    def publish(self, data, topic=None, event="sample"):
+        line = json.dumps({"topic": topic, "event": event, "data": data}).encode() + b"\n"
+        with self.lock:
+            # One write per line, so followers never see an event interleaved with another.
+            self.file.write(line)
+            self.file.flush()
+            self.published += 1
+            if self.file.tell() >= self.max_bytes:
+                self.file.close()
+                os.replace(self.path, self.path + ".1")
+                self.file = open(self.path, "ab")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def stats(self):
+        return {"published": self.published}
+
+
+class EventFollower:
+    def __init__(self, path):
+        """Reads the events an EventFile appends, like tail -F.
+
+        Only events appended after the follower was created are returned.
+        When the file is rotated the rest of the old file is read before
+        switching to the new one.
+        """
+        self.path = path
+        self.partial = b""
+        self.file = self._open()
+        if self.file is not None:
+            self.file.seek(0, os.SEEK_END)
+
+    def _open(self):
+        try:
+            return open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+
+    def _read(self):
+        chunk = self.file.read()
+        if not chunk:
+            return []
+        lines = (self.partial + chunk).split(b"\n")
+        self.partial = lines.pop()
+        return lines
+
+    def _rotated(self):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def poll(self):
+        """Returns the (topic, event, data) tuples appended since the last poll, oldest first."""
+        if self.file is None:
+            # Created after this follower: everything in it is new.
+            self.file = self._open()
+            if self.file is None:
+                return []
+        lines = self._read()
+        if self._rotated():
+            # The writer no longer touches the old file, so this read is its last.
+            lines += self._read()
+            self.file.close()
+            self.partial = b""
+            self.file = self._open()
+            if self.file is not None:
+                lines += self._read()
+
+        events = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            events.append((entry["topic"], entry["event"], entry["data"]))
+        return events
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
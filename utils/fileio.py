@@ -0,0 +1,15 @@
+import os
+
+
+def atomic_write(path, data):
+    """Replaces `path` with `data` (str or bytes) in one step.
+
+    The data goes to a temporary file next to `path` that is then renamed
+    over it, so a reader in another process sees either the old file or the
+    new one, never a partial write. The temporary name carries the pid, so
+    processes writing the same file do not clobber each other's.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,256 @@
+import math
+from datetime import datetime
+import numpy as np
+from utils.ring_buffer import FIELD_NAMES, columns_to_records
+
+# Upper bound on points in any /sensor/history response.
+MAX_POINTS = 2000
+AGGREGATIONS = ("mean", "min", "max", "std", "p95", "count")
+# Aggregations that can be answered from count/sum/sumsq/min/max rollups.
+ROLLUP_AGGREGATIONS = ("mean", "min", "max", "std", "count")
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+MAX_BUCKET = 3660 * 86400  # as far back as the daily rollups go
+MAX_EPOCH = 253402300799  # 9999-12-31 23:59:59, the last second datetime can format
+
+
+def parse_bucket(value):
+    """Parses a bucket width such as "30s", "1m", "1h" or "1d" into seconds."""
+    if value is None or value == "":
+        return None
+    value = value.strip().lower()
+    if value[-1] in BUCKET_UNITS:
+        number, unit = value[:-1], BUCKET_UNITS[value[-1]]
+    else:
+        number, unit = value, 1
+    try:
+        seconds = int(number) * unit
+    except ValueError:
+        raise ValueError(f"Invalid bucket '{value}', expected e.g. 30s, 1m, 1h or 1d")
+    if seconds <= 0:
+        raise ValueError("bucket must be positive")
+    if seconds > MAX_BUCKET:
+        raise ValueError("bucket must be at most 3660d")
+    return seconds
+
+
+def parse_time(value):
+    """Parses an epoch number or an ISO / "%Y-%m-%d %H:%M:%S" string into epoch seconds."""
+    if value is None or value == "":
+        return None
+    try:
+        epoch = int(float(value))
+    except (ValueError, OverflowError):
+        pass  # not a number, or inf
+    else:
+        if abs(epoch) > MAX_EPOCH:
+            raise ValueError(f"Time '{value}' is out of range")
+        return epoch
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}', expected epoch seconds or YYYY-MM-DD HH:MM:SS")
+
+
+def parse_fields(value):
+    """Parses a comma separated field list, defaulting to every field."""
+    if value is None or value == "":
+        return list(FIELD_NAMES)
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in FIELD_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(FIELD_NAMES)}")
+    return fields
+
+
+def fit_bucket(bucket, start_ts, end_ts, max_points=MAX_POINTS):
+    """Widens `bucket` until the [start_ts, end_ts] span fits in `max_points` buckets.
+
+    A widened bucket is rounded up to a whole number of minutes, hours or days.
+    """
+    span = end_ts - start_ts + 1
+    if math.ceil(span / bucket) > max_points:
+        bucket = math.ceil(span / max_points)
+        unit = max(u for u in BUCKET_UNITS.values() if u <= bucket)
+        bucket = math.ceil(bucket / unit) * unit
+    return bucket
+
+
+def fit_rollup_bucket(bucket, start_ts, end_ts, rollups, max_points=MAX_POINTS):
+    """Like fit_bucket, but picks a rollup level that covers [start_ts, end_ts] when it can.
+
+    A bucket that already fits is kept as it is. A widened one becomes the
+    smallest multiple of a covering level's resolution, so month-long views
+    are served from hourly or daily rollups instead of raw samples.
+    Returns (bucket, level), with level None when raw samples must be used.
+    """
+    needed = math.ceil((end_ts - start_ts + 1) / max_points)
+    if bucket < needed:
+        widened = [math.ceil(needed / level.resolution) * level.resolution for level in rollups.covering(start_ts)]
+        if not widened:
+            return fit_bucket(bucket, start_ts, end_ts, max_points), None
+        bucket = min(widened)
+    return bucket, rollups.select(bucket, start_ts)
+
+
+def bucket_bounds(timestamps, bucket):
+    """Splits sorted timestamps into buckets.
+
+    Returns the bucket start times and the index where each bucket begins.
+    """
+    ids = timestamps // bucket
+    starts = np.flatnonzero(np.diff(ids, prepend=ids[0] - 1))
+    return ids[starts] * bucket, starts
+
+
+def aggregate(values, starts, counts, agg):
+    """Reduces each bucket of `values` with one vectorized NumPy call."""
+    if agg == "count":
+        return counts
+    if agg == "min":
+        return np.minimum.reduceat(values, starts)
+    if agg == "max":
+        return np.maximum.reduceat(values, starts)
+    values = values.astype(np.float64)
+    if agg == "mean":
+        return np.add.reduceat(values, starts) / counts
+    if agg == "std":
+        mean = np.add.reduceat(values, starts) / counts
+        return np.sqrt(np.maximum(np.add.reduceat(values * values, starts) / counts - mean * mean, 0.0))
+    if agg == "p95":
+        # Sort within each bucket (buckets are already contiguous), then pick
+        # the nearest-rank 95th percentile of every bucket at once.
+        group = np.repeat(np.arange(len(starts)), counts)
+        ordered = values[np.lexsort((values, group))]
+        return ordered[starts + np.ceil(0.95 * counts).astype(np.int64) - 1]
+    raise ValueError(f"Unknown agg '{agg}'. Available: {', '.join(AGGREGATIONS)}")
+
+
+def downsample(columns, fields, bucket, agg):
+    """Buckets raw columns by `bucket` seconds and aggregates every requested field."""
+    timestamps = columns["timestamp"]
+    if len(timestamps) == 0:
+        return {"timestamp": timestamps, **{field: columns[field] for field in fields}}
+    bucket_ts, starts = bucket_bounds(timestamps, bucket)
+    counts = np.diff(np.append(starts, len(timestamps)))
+    result = {"timestamp": bucket_ts}
+    for field in fields:
+        result[field] = aggregate(columns[field], starts, counts, agg)
+    return result
+
+
+def raw_rollup(columns, resolution):
+    """Folds raw columns into rollup-style buckets of `resolution` seconds (see utils.rollup)."""
+    timestamps = columns["timestamp"]
+    if len(timestamps) == 0:
+        empty = np.zeros((0, len(FIELD_NAMES)))
+        return {"timestamp": timestamps.astype(np.int64), "count": np.zeros(0, dtype=np.int64),
+                "sum": empty, "sumsq": empty, "min": empty, "max": empty}
+    bucket_ts, starts = bucket_bounds(timestamps, resolution)
+    values = np.column_stack([columns[name].astype(np.float64) for name in FIELD_NAMES])
+    return {
+        "timestamp": bucket_ts,
+        "count": np.diff(np.append(starts, len(timestamps))),
+        "sum": np.add.reduceat(values, starts, axis=0),
+        "sumsq": np.add.reduceat(values * values, starts, axis=0),
+        "min": np.minimum.reduceat(values, starts, axis=0),
+        "max": np.maximum.reduceat(values, starts, axis=0),
+    }
+
+
+def query_rollup(source, rollups, level, start_ts, end_ts):
+    """Returns rollup bucket columns covering exactly [start_ts, end_ts].
+
+    Rollup buckets that lie wholly inside the range are read from `level`;
+    the partial buckets at either edge are computed from raw samples, so no
+    reading outside the range is counted.
+    """
+    resolution = level.resolution
+    first = -(-start_ts // resolution) * resolution  # first bucket boundary at or after start_ts
+    stop = (end_ts + 1) // resolution * resolution  # end of the last whole bucket
+    if first >= stop:
+        return raw_rollup(source.query(start_ts, end_ts), resolution)
+    parts = [
+        raw_rollup(source.query(start_ts, first - 1), resolution),
+        rollups.query(level, first, stop - 1),
+        raw_rollup(source.query(stop, end_ts), resolution),
+    ]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[1]}
+
+
+def downsample_rollup(columns, fields, bucket, agg):
+    """Merges rollup buckets into `bucket` second buckets and aggregates every requested field."""
+    timestamps = columns["timestamp"]
+    if len(timestamps) == 0:
+        return {"timestamp": timestamps, **{field: np.zeros(0) for field in fields}}
+    bucket_ts, starts = bucket_bounds(timestamps, bucket)
+    counts = np.add.reduceat(columns["count"], starts)
+    result = {"timestamp": bucket_ts}
+    for field in fields:
+        i = FIELD_NAMES.index(field)
+        if agg == "count":
+            result[field] = counts
+        elif agg == "min":
+            result[field] = np.minimum.reduceat(columns["min"][:, i], starts)
+        elif agg == "max":
+            result[field] = np.maximum.reduceat(columns["max"][:, i], starts)
+        else:
+            mean = np.add.reduceat(columns["sum"][:, i], starts) / counts
+            if agg == "std":
+                sumsq = np.add.reduceat(columns["sumsq"][:, i], starts) / counts
+                mean = np.sqrt(np.maximum(sumsq - mean * mean, 0.0))
+            result[field] = mean
+    return result
+
+
+def run_query(source, start=None, end=None, fields=None, bucket=None, agg="mean", limit=None, rollups=None):
+    """Answers a /sensor/history query against `source`.
+
+    `source` is anything with query(start_ts, end_ts, limit=None) returning
+    column arrays and time_range() (Esp32, TimeSeriesStore, RingBuffer).
+    Raw queries return the most recent `limit` samples; bucketed queries
+    widen the bucket when needed so the response never exceeds MAX_POINTS
+    rows. When `rollups` (utils.rollup.Rollups) has a level that covers the
+    range and nests inside the bucket, bucketed queries read rollup buckets
+    instead of raw samples and give the same answer.
+    """
+    start_ts = parse_time(start)
+    end_ts = parse_time(end)
+    fields = parse_fields(fields)
+    bucket = parse_bucket(bucket)
+    agg = (agg or "mean").lower()
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"Unknown agg '{agg}'. Available: {', '.join(AGGREGATIONS)}")
+    if start_ts is not None and end_ts is not None and start_ts > end_ts:
+        raise ValueError("start must not be after end")
+
+    meta = {"start": start_ts, "end": end_ts, "fields": fields}
+    if bucket is None:
+        limit = MAX_POINTS if limit is None else max(1, min(int(limit), MAX_POINTS))
+        columns = source.query(start_ts, end_ts, limit=limit)
+        meta["limit"] = limit
+    else:
+        # Clip the range to the stored history, so the bucket is fitted to
+        # (and the rollup level checked against) the data actually asked for.
+        stored = source.time_range()
+        lo = hi = level = None
+        if stored is not None:
+            lo = stored[0] if start_ts is None else max(start_ts, stored[0])
+            hi = stored[1] if end_ts is None else min(end_ts, stored[1])
+        if lo is not None and lo <= hi:
+            if rollups is not None and agg in ROLLUP_AGGREGATIONS:
+                bucket, level = fit_rollup_bucket(bucket, lo, hi, rollups)
+            else:
+                bucket = fit_bucket(bucket, lo, hi)
+
+        if level is not None:
+            columns = downsample_rollup(query_rollup(source, rollups, level, lo, hi), fields, bucket, agg)
+            meta["resolution"] = level.resolution
+        else:
+            columns = downsample(source.query(start_ts, end_ts), fields, bucket, agg)
+        meta["bucket"] = bucket
+        meta["agg"] = agg
+
+    selected = {"timestamp": columns["timestamp"]}
+    for field in fields:
+        selected[field] = columns[field]
+    return columns_to_records(selected), meta
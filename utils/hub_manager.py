@@ -0,0 +1,308 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+import serial
+from utils.esp32 import Esp32, find_esp32_ports, device_id_for
+from utils.serial_reader import LineFramer, parse_frame, put_with_policy, DROP_OLDEST
+from utils.ts_store import TimeSeriesStore
+from utils.rollup import Rollups
+from utils.anomaly import AnomalyLog
+from utils.sim_serial import transport_id
+from utils.log import get_logger
+from utils.metrics import REGISTRY, FAST_BUCKETS
+
+log = get_logger("hub")
+PARSE_SECONDS = REGISTRY.histogram("desiot_parse_seconds", "Time to decode one serial frame.", labels=("device",), buckets=FAST_BUCKETS)
+PROCESS_SECONDS = REGISTRY.histogram("desiot_process_seconds", "Time to apply one reading to latest, filter, detector, history and rollups.",
+                                     labels=("device",), buckets=FAST_BUCKETS)
+
+
+class UnknownDeviceError(LookupError):
+    """Raised by get() for a device id that is not attached."""
+
+
+class NoDeviceError(LookupError):
+    """Raised by get() when no device is attached at all."""
+
+
+class HubDevice:
+    def __init__(self, esp32, max_frame=1024):
+        """Per-port ingest state: the Esp32 that owns the port plus its framer and counters."""
+        self.esp32 = esp32
+        self.framer = LineFramer(max_frame)
+        self.bytes_read = 0
+        self.lines = 0
+        self.parse_errors = 0
+        self.lines_per_second = 0.0
+        self._rate_mark = (time.monotonic(), 0)
+        self.parse_seconds = PARSE_SECONDS.labels(esp32.device_id)
+        self.process_seconds = PROCESS_SECONDS.labels(esp32.device_id)
+
+    @property
+    def device_id(self):
+        return self.esp32.device_id
+
+    def update_rate(self):
+        """Refreshes lines_per_second once at least a second has passed since the last refresh."""
+        now = time.monotonic()
+        mark_time, mark_lines = self._rate_mark
+        if now - mark_time >= 1.0:
+            self.lines_per_second = (self.lines - mark_lines) / (now - mark_time)
+            self._rate_mark = (now, self.lines)
+
+    def stats(self):
+        # Also refreshed here, so a device that went quiet reports its rate dropping.
+        self.update_rate()
+        stats = {
+            "port": self.esp32.port,
+            "bytes": self.bytes_read,
+            "lines": self.lines,
+            "lines_per_second": round(self.lines_per_second, 2),
+            "parse_errors": self.parse_errors + self.framer.overflows,
+        }
+        if self.esp32.filter is not None:
+            stats["filter"] = self.esp32.filter.stats()
+        if self.esp32.detector is not None:
+            stats["anomalies"] = self.esp32.detector.stats()
+        return stats
+
+
+class HubManager:
+    def __init__(self, baudrate=115200, cache_size=100, data_dir="data", rescan_interval=5,
+                 queue_size=4096, drop_policy=DROP_OLDEST, ports=None, uplink=None, filter_factory=None, broadcaster=None, share_latest=False,
+                 detector_factory=None, log_sample_interval=10.0, uplink_device=None):
+        """Reads every connected ESP32 concurrently on one asyncio event loop.
+
+        Ports matching ESP32_IDENTIFIERS are discovered with comports() and
+        rescanned every `rescan_interval` seconds to pick up hot-plugged
+        devices. Each port is opened non-blocking and watched with
+        loop.add_reader, so dozens of devices share a single thread. Parsed
+        samples go into one bounded queue as (device_id, epoch, dict) tuples
+        and are applied to the owning Esp32 by consume(). Pass `ports` to use a
+        fixed list of device paths instead of discovery. The `uplink` feeds
+        one ThingSpeak channel, so it only receives the readings of
+        `uplink_device`, or of the only attached device when that is None;
+        while several devices are attached without a chosen one nothing is
+        uploaded.
+        `filter_factory` builds each device's DeadbandFilter and a shared
+        `broadcaster` publishes accepted samples under the device id. With
+        `share_latest` every device also writes its latest snapshot to
+        `data_dir`/latest for web workers in other processes.
+        `detector_factory` builds each device's AnomalyDetector; its events
+        are kept in `data_dir`/anomalies/<device>.jsonl. `ports` may include
+        simulated ports (see utils.sim_serial). Each device logs at most one
+        stored reading per `log_sample_interval` seconds.
+        """
+        self.baudrate = baudrate
+        self.cache_size = cache_size
+        self.data_dir = data_dir
+        self.rescan_interval = rescan_interval
+        self.fixed_ports = ports
+        self.uplink = uplink
+        self.uplink_device = uplink_device
+        self.uplink_owner = None
+        self.filter_factory = filter_factory
+        self.broadcaster = broadcaster
+        self.share_latest = share_latest
+        self.detector_factory = detector_factory
+        self.log_sample_interval = log_sample_interval
+        if share_latest:
+            os.makedirs(os.path.join(data_dir, "latest"), exist_ok=True)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.drop_policy = drop_policy
+        self.drops = 0
+
+        self.devices = {}  # device_id -> HubDevice
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+
+    def _discover(self):
+        """Returns {device_id: device path} for every port that should be open."""
+        if self.fixed_ports is not None:
+            return {transport_id(path): path for path in self.fixed_ports}
+        return {device_id_for(port): port.device for port in find_esp32_ports()}
+
+    def _open(self, device_id, path):
+        """Opens one port non-blocking with its own history store and rollups."""
+        esp32 = Esp32(
+            port=path,
+            baudrate=self.baudrate,
+            timeout=0,
+            cache_size=self.cache_size,
+            store=TimeSeriesStore(path=os.path.join(self.data_dir, "history", device_id)),
+            rollups=Rollups(path=os.path.join(self.data_dir, "rollups", device_id)),
+            device_id=device_id,
+            filter=self.filter_factory() if self.filter_factory else None,
+            broadcaster=self.broadcaster,
+            latest_path=os.path.join(self.data_dir, "latest", f"{device_id}.json") if self.share_latest else None,
+            detector=self.detector_factory() if self.detector_factory else None,
+            anomalies=AnomalyLog(path=os.path.join(self.data_dir, "anomalies", f"{device_id}.jsonl")),
+            log_sample_interval=self.log_sample_interval,
+        )
+        if not esp32.ser:
+            esp32.store.close()
+            if esp32.transport is not None:
+                esp32.transport.close()
+            return None
+        return HubDevice(esp32)
+
+    def rescan(self):
+        """Attaches newly plugged devices and detaches ones that disappeared."""
+        wanted = self._discover()
+        for device_id in [d for d in self.devices if d not in wanted]:
+            self._detach(device_id)
+        for device_id, path in wanted.items():
+            if device_id in self.devices:
+                continue
+            device = self._open(device_id, path)
+            if device is None:
+                continue
+            with self.lock:
+                self.devices[device_id] = device
+            self.loop.add_reader(device.esp32.ser.fileno(), self._on_readable, device)
+            log.info("Attached %s on %s", device_id, path)
+        self._assign_uplink()
+
+    def _assign_uplink(self):
+        """Hands the uplink to the one device whose readings go to the ThingSpeak channel."""
+        if self.uplink is None:
+            return
+        with self.lock:
+            devices = dict(self.devices)
+        if self.uplink_device:
+            owner = self.uplink_device if self.uplink_device in devices else None
+        else:
+            owner = next(iter(devices)) if len(devices) == 1 else None
+        for device_id, device in devices.items():
+            device.esp32.uplink = self.uplink if device_id == owner else None
+        if owner != self.uplink_owner:
+            if owner is not None:
+                log.info("Uploading %s to ThingSpeak", owner)
+            elif len(devices) > 1 and not self.uplink_device:
+                log.error("ThingSpeak uplink paused: %s devices attached share one channel; "
+                          "choose one with --thingspeak-device", len(devices))
+            self.uplink_owner = owner
+
+    def _detach(self, device_id):
+        with self.lock:
+            device = self.devices.pop(device_id, None)
+        if device is None:
+            return
+        esp32 = device.esp32
+        try:
+            self.loop.remove_reader(esp32.ser.fileno())
+        except (ValueError, OSError):
+            pass
+        try:
+            esp32.ser.close()
+        except (serial.SerialException, OSError):
+            pass
+        if esp32.transport is not None:
+            esp32.transport.close()
+        if esp32.store is not None:
+            esp32.store.close()
+        if esp32.rollups is not None:
+            esp32.rollups.flush()
+        log.info("Detached %s", device_id)
+
+    def _on_readable(self, device):
+        """Drains whatever a ready port has buffered without blocking the loop."""
+        ser = device.esp32.ser
+        try:
+            chunk = ser.read(ser.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            # Readable with nothing to read (or an I/O error) means the device went away.
+            log.error("%s: %s", device.device_id, e)
+            self._detach(device.device_id)
+            self._assign_uplink()
+            return
+        if not chunk:
+            return
+        device.bytes_read += len(chunk)
+        now = time.time()
+        for frame in device.framer.feed(chunk):
+            device.lines += 1
+            start = time.perf_counter()
+            data = parse_frame(frame)
+            device.parse_seconds.observe(time.perf_counter() - start)
+            if data is None:
+                device.parse_errors += 1
+                continue
+            if put_with_policy(self.queue, (device.device_id, now, data), self.drop_policy):
+                self.drops += 1
+        device.update_rate()
+
+    async def _rescan_forever(self):
+        while True:
+            try:
+                self.rescan()
+            except Exception as e:
+                log.error("Rescan failed: %s", e)
+            await asyncio.sleep(self.rescan_interval)
+
+    def start(self):
+        """Runs the event loop on a background thread."""
+        self.loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            rescan = self.loop.create_task(self._rescan_forever())
+            self.loop.run_forever()
+            # stop() was called: let the rescan task unwind before closing the loop.
+            rescan.cancel()
+            self.loop.run_until_complete(asyncio.gather(rescan, return_exceptions=True))
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True, name="hub-manager")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Detaches every device and stops the event loop."""
+        def shutdown():
+            for device_id in list(self.devices):
+                self._detach(device_id)
+            self.loop.stop()
+
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(shutdown)
+            self.thread.join(5)
+
+    def consume(self, timeout=1):
+        """Applies the next queued sample to its device. Returns the processed sample, or None."""
+        try:
+            device_id, timestamp, data = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self.lock:
+            device = self.devices.get(device_id)
+        if device is None:
+            return None
+        with device.process_seconds.time():
+            return device.esp32.process(timestamp, data)
+
+    def device_ids(self):
+        with self.lock:
+            return sorted(self.devices)
+
+    def get(self, device_id=None):
+        """Returns the Esp32 for `device_id`, or the first device when it is omitted.
+
+        Raises UnknownDeviceError for an unknown id and NoDeviceError when nothing is attached.
+        """
+        with self.lock:
+            if device_id:
+                if device_id not in self.devices:
+                    raise UnknownDeviceError(device_id)
+                return self.devices[device_id].esp32
+            if not self.devices:
+                raise NoDeviceError("No ESP32 device attached")
+            return self.devices[min(self.devices)].esp32
+
+    def stats(self):
+        with self.lock:
+            devices = {device_id: device.stats() for device_id, device in self.devices.items()}
+        return {"devices": devices, "drops": self.drops, "queue_depth": self.queue.qsize()}
@@ -0,0 +1,129 @@
+import json
+import os
+import signal
+import time
+from utils.config import load_config, serial_ports, field_values
+from utils.anomaly import AnomalyDetector
+from utils.event_file import EventFile
+from utils.fileio import atomic_write
+from utils.deadband import DeadbandFilter, DEFAULT_ABSOLUTE
+from utils.hub_manager import HubManager
+from utils.thingspeak_uplink import ThingSpeakUplink
+from utils.log import get_logger, fields, setup_logging
+from utils.metrics import REGISTRY, hub_collector, uplink_collector, write_metrics
+from utils.profiler import SamplingProfiler
+
+log = get_logger("ingest")
+
+
+def build_uplink(config):
+    """Returns the ThingSpeak uplink, or None when no channel is configured."""
+    if not config.thingspeak_channel_id:
+        return None
+    return ThingSpeakUplink(
+        config.thingspeak_write_api_key,
+        config.thingspeak_channel_id,
+        spool_dir=os.path.join(config.data_dir, "uplink_spool"),
+    )
+
+
+def build_filter_factory(config):
+    """Returns a factory for each device's DeadbandFilter, or None when `config.filter` is off."""
+    if config.filter == "off":
+        return None
+    absolute = {**DEFAULT_ABSOLUTE, **(field_values(config.deadband) or {})}
+    relative = field_values(config.deadband_relative)
+    swinging_door = config.filter == "swinging_door"
+    return lambda: DeadbandFilter(absolute=absolute, relative=relative, max_silence=config.max_silence, swinging_door=swinging_door)
+
+
+def build_hub(config, broadcaster=None, share_latest=False):
+    """Builds the HubManager that owns the serial ports described by `config`."""
+    return HubManager(
+        baudrate=config.baudrate,
+        cache_size=config.cache_size,
+        data_dir=config.data_dir,
+        rescan_interval=config.rescan_interval,
+        ports=serial_ports(config),
+        uplink=build_uplink(config),
+        uplink_device=config.thingspeak_device or None,
+        filter_factory=build_filter_factory(config),
+        broadcaster=broadcaster,
+        share_latest=share_latest,
+        detector_factory=AnomalyDetector,
+        log_sample_interval=config.log_sample_seconds,
+    )
+
+
+def write_stats(path, hub):
+    """Atomically replaces `path` with hub.stats(), for the web workers' /sensor/devices."""
+    atomic_write(path, json.dumps({**hub.stats(), "updated_at": time.time()}))
+
+
+def run_ingest(hub, metrics_path=None, metrics_interval=5, stats_path=None, stats_interval=1):
+    """Starts the hub event loop and the uplink, then feeds every queued sample into its device forever.
+
+    With `metrics_path` the process metrics are written there every
+    `metrics_interval` seconds for the web workers' /metrics, and with
+    `stats_path` the hub stats every `stats_interval` seconds.
+    """
+    REGISTRY.register(hub_collector(hub))
+    if hub.uplink is not None:
+        REGISTRY.register(uplink_collector(hub.uplink))
+        hub.uplink.start()
+    hub.start()
+    next_write = next_stats = 0
+    while True:
+        try:
+            hub.consume(timeout=1)
+        except Exception as e:
+            log.error("Failed to process data: %s", e)
+        if stats_path is not None and time.monotonic() >= next_stats:
+            next_stats = time.monotonic() + stats_interval
+            try:
+                write_stats(stats_path, hub)
+            except OSError as e:
+                log.error("Could not write stats: %s", e)
+        if metrics_path is not None and time.monotonic() >= next_write:
+            next_write = time.monotonic() + metrics_interval
+            try:
+                write_metrics(metrics_path)
+            except OSError as e:
+                log.error("Could not write metrics: %s", e)
+
+
+def install_profiler_toggle(profile_dir):
+    """Makes SIGUSR2 start the sampling profiler and, sent again, dump the hot stacks to `profile_dir`."""
+    profiler = SamplingProfiler()
+
+    def toggle(signum, frame):
+        if not profiler.stop():
+            profiler.start()
+            log.info("Profiler started, send SIGUSR2 again to dump the stacks", extra=fields(pid=os.getpid()))
+            return
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, time.strftime("ingest-%Y%m%d-%H%M%S.collapsed"))
+        with open(path, "w") as f:
+            f.write(profiler.collapsed())
+        report = profiler.report(top=5)
+        log.info("Profile of %s samples written to %s", report["samples"], path)
+        for entry in report["top_functions"]:
+            log.info("  %5.1f%% %s", entry["percent"], entry["function"])
+
+    signal.signal(signal.SIGUSR2, toggle)
+    return profiler
+
+
+def main(argv=None):
+    """Entry point of the dedicated ingest process: reads serial data and shares it through `data_dir`."""
+    config = load_config(argv)
+    setup_logging(config.log_level, config.log_format)
+    if config.profiling:
+        install_profiler_toggle(os.path.join(config.data_dir, "profiles"))
+    metrics_dir = os.path.join(config.data_dir, "metrics")
+    os.makedirs(metrics_dir, exist_ok=True)
+    # Accepted samples and anomaly events reach the web workers' /sensor/stream through this file.
+    events = EventFile(os.path.join(config.data_dir, "events", "events.jsonl"))
+    run_ingest(build_hub(config, broadcaster=events, share_latest=True),
+               metrics_path=os.path.join(metrics_dir, "ingest.prom"),
+               stats_path=os.path.join(config.data_dir, "stats.json"))
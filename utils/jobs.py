@@ -0,0 +1,117 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils.fileio import atomic_write
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class JobManager:
+    def __init__(self, max_workers=4, ttl=600, max_jobs=1000, path=None):
+        """Runs slow calls on a small worker pool and keeps their results for polling.
+
+        Finished jobs are forgotten `ttl` seconds after they complete; at most
+        `max_jobs` are tracked, after which submit() raises RuntimeError.
+        With `path` every job is also written to `path`/<id>.json, so web
+        workers in other processes can answer polls for it.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.path = path
+        self.jobs = {}  # job_id -> dict
+        self.lock = threading.Lock()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self._sweep()
+
+    def _file(self, job_id):
+        return os.path.join(self.path, f"{job_id}.json")
+
+    def _sweep(self):
+        """Removes job files nobody updated for `ttl` seconds, e.g. of a worker that was restarted."""
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.path):
+            file = os.path.join(self.path, name)
+            try:
+                if os.stat(file).st_mtime < cutoff:
+                    os.remove(file)
+            except OSError:
+                pass
+
+    def _save(self, job):
+        """Atomically replaces the job file."""
+        atomic_write(self._file(job["id"]), json.dumps(job))
+
+    def _load(self, job_id):
+        """Returns a job written by another process, or None when it is unknown or expired."""
+        try:
+            with open(self._file(job_id)) as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if job["expires_at"] and job["expires_at"] < time.time():
+            return None
+        return job
+
+    def _expire(self):
+        now = time.time()
+        for job_id in [j for j, job in self.jobs.items() if job["expires_at"] and job["expires_at"] < now]:
+            del self.jobs[job_id]
+            if self.path is not None:
+                try:
+                    os.remove(self._file(job_id))
+                except OSError:
+                    pass
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedules fn(*args, **kwargs) and returns the job id immediately."""
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self._expire()
+            if len(self.jobs) >= self.max_jobs:
+                raise RuntimeError("Too many pending jobs, try again later")
+            job = self.jobs[job_id] = {"id": job_id, "status": PENDING, "submitted_at": time.time(), "expires_at": None}
+            if self.path is not None:
+                self._save(job)
+        self.executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=RUNNING, started_at=time.time())
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._update(job_id, status=FAILED, error=str(e), finished_at=time.time(), expires_at=time.time() + self.ttl)
+        else:
+            self._update(job_id, status=DONE, result=result, finished_at=time.time(), expires_at=time.time() + self.ttl)
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+                if self.path is not None:
+                    self._save(job)
+
+    def get(self, job_id):
+        """Returns a copy of the job, or None when it is unknown or expired."""
+        with self.lock:
+            self._expire()
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job = dict(job)
+        if job is None and self.path is not None and JOB_ID.fullmatch(job_id):
+            job = self._load(job_id)
+        if job is None:
+            return None
+        job.pop("expires_at", None)
+        return job
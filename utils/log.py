@@ -0,0 +1,80 @@
+import json
+import logging
+import sys
+import time
+
+ROOT = "desiot"
+
+
+class TextFormatter(logging.Formatter):
+    """Formats records like the rest of the console output: [TAG][LEVEL] message key=value ..."""
+
+    def format(self, record):
+        tag = record.name[len(ROOT) + 1:].upper() if record.name.startswith(ROOT + ".") else record.name.upper()
+        line = f"[{tag}][{record.levelname}] {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line for log shippers."""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level="INFO", fmt="text"):
+    """Configures every desiot.* logger; safe to call more than once."""
+    root = logging.getLogger(ROOT)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler(sys.stdout))
+        root.propagate = False
+    for handler in root.handlers:
+        handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    return root
+
+
+def get_logger(name):
+    """Returns the logger for one component, e.g. get_logger("hub") prints as [HUB][INFO] ..."""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+def fields(**values):
+    """Structured key/value context for a log call: log.info("msg", extra=fields(device=...))."""
+    return {"fields": values}
+
+
+class Sampler:
+    def __init__(self, interval=10.0):
+        """Lets at most one event through every `interval` seconds (0: every event).
+
+        allow() returns None for a suppressed event and otherwise the number
+        of events suppressed since the last one that went through, so sampled
+        log lines can say how much they stand for.
+        """
+        self.interval = interval
+        self.next = 0.0
+        self.suppressed = 0
+
+    def allow(self):
+        now = time.monotonic()
+        if now < self.next:
+            self.suppressed += 1
+            return None
+        self.next = now + self.interval
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
@@ -0,0 +1,302 @@
+import bisect
+import os
+import threading
+import time
+from utils.fileio import atomic_write
+
+# Latency buckets in seconds.
+FAST_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 5e-3)
+HTTP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None, const=None):
+    pairs = list(const.items() if const else ()) + list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [("", None, self.value)]
+
+
+class _GaugeChild(_CounterChild):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager that observes the duration of its block."""
+        return _Timer(self)
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            samples.append(("_bucket", ("le", _number(bound)), cumulative))
+        samples.append(("_sum", None, total))
+        samples.append(("_count", None, cumulative))
+        return samples
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    def __init__(self, name, help_text, kind, labels, factory):
+        """One metric family. Labeled families hand out children with labels(); unlabeled ones act as their only child."""
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labels)
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = factory()
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+    # Shortcuts for unlabeled families.
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def collect(self):
+        return [(self.labelnames, values, child.samples()) for values, child in list(self.children.items())]
+
+
+class Registry:
+    def __init__(self):
+        """Holds metrics and collectors and renders them in the Prometheus text format.
+
+        Collectors are callables returning (name, kind, help, [(labels dict,
+        value), ...]) tuples; they turn existing stats() counters into metrics
+        at scrape time, so the hot paths pay nothing for them.
+        """
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def _add(self, name, help_text, kind, labels, factory):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Metric(name, help_text, kind, labels, factory)
+            return self.metrics[name]
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(name, help_text, "counter", labels, _CounterChild)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(name, help_text, "gauge", labels, _GaugeChild)
+
+    def histogram(self, name, help_text, labels=(), buckets=HTTP_BUCKETS):
+        buckets = tuple(sorted(buckets))
+        return self._add(name, help_text, "histogram", labels, lambda: _HistogramChild(buckets))
+
+    def register(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+        return collector
+
+    def render(self, labels=None):
+        """Renders every metric; `labels` (e.g. {"worker": pid}) are added to every sample."""
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+        for metric in metrics:
+            families = metric.collect()
+            if not families:
+                continue  # labeled metric nobody has used in this process
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for names, values, samples in families:
+                for suffix, extra, value in samples:
+                    lines.append(f"{metric.name}{suffix}{_labels(names, values, extra, labels)} {_number(value)}")
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception:
+                continue  # a component that is shutting down must not break the scrape
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for sample_labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_labels(sample_labels.keys(), sample_labels.values(), const=labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def write_metrics(path, registry=REGISTRY, labels=None):
+    """Atomically writes the rendered metrics, for web workers in another process to serve."""
+    atomic_write(path, registry.render(labels))
+
+
+def read_metrics(paths, max_age=None):
+    """Returns the texts of the metric files in `paths`, skipping missing ones and ones older than `max_age` seconds."""
+    texts = []
+    now = time.time()
+    for path in paths:
+        try:
+            if max_age is not None and now - os.stat(path).st_mtime > max_age:
+                continue  # left behind by a process that is gone
+            with open(path) as f:
+                texts.append(f.read())
+        except FileNotFoundError:
+            continue
+    return texts
+
+
+def join_metrics(texts):
+    """Joins rendered metrics of several processes, so each family has one HELP/TYPE header and all its samples."""
+    families = {}  # name -> [help line, type line, samples]
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split(" ", 3)[2]
+                family = families.setdefault(name, [line, None, []])
+            elif line.startswith("# TYPE "):
+                name = line.split(" ", 3)[2]
+                family = families.setdefault(name, [None, line, []])
+                family[1] = family[1] or line
+            elif line and family is not None:
+                family[2].append(line)
+    lines = []
+    for help_line, type_line, samples in families.values():
+        lines += [line for line in (help_line, type_line) if line] + samples
+    return "\n".join(lines) + "\n"
+
+
+def hub_collector(hub):
+    """Serial and ingest-queue metrics from HubManager.stats()."""
+    def collect():
+        stats = hub.stats()
+        devices = stats["devices"]
+        yield ("desiot_serial_bytes_total", "counter", "Bytes read from the serial port.",
+               [({"device": d}, s["bytes"]) for d, s in devices.items()])
+        yield ("desiot_serial_lines_total", "counter", "Lines framed from the serial port.",
+               [({"device": d}, s["lines"]) for d, s in devices.items()])
+        yield ("desiot_serial_errors_total", "counter", "Malformed or oversized serial frames.",
+               [({"device": d}, s["parse_errors"]) for d, s in devices.items()])
+        yield ("desiot_filter_passed_total", "counter", "Readings the deadband filter passed to storage.",
+               [({"device": d}, s["filter"]["passed"]) for d, s in devices.items() if "filter" in s])
+        yield ("desiot_anomalies_total", "counter", "Anomaly events detected.",
+               [({"device": d}, s["anomalies"]["events"]) for d, s in devices.items() if "anomalies" in s])
+        yield ("desiot_ingest_queue_depth", "gauge", "Parsed samples waiting to be processed.", [({}, stats["queue_depth"])])
+        yield ("desiot_ingest_drops_total", "counter", "Samples dropped because the ingest queue was full.", [({}, stats["drops"])])
+    return collect
+
+
+def cache_collector(name, cache):
+    """Size and hit/miss metrics from ResponseCache.stats()."""
+    def collect():
+        stats = cache.stats()
+        labels = {"cache": name}
+        yield ("desiot_cache_entries", "gauge", "Entries in the cache.", [(labels, stats["size"])])
+        yield ("desiot_cache_requests_total", "counter", "Cache lookups by result.",
+               [({**labels, "result": result}, stats[result]) for result in ("hits", "misses", "coalesced")])
+        yield ("desiot_cache_hit_ratio", "gauge", "Share of lookups answered without computing.", [(labels, stats["hit_rate"])])
+    return collect
+
+
+def transport_collector(transport):
+    """Call, retry and breaker metrics from RAGTransport.stats()."""
+    def collect():
+        stats = transport.stats()
+        yield ("desiot_rag_calls_total", "counter", "RAG calls sent upstream.", [({}, stats["calls"])])
+        yield ("desiot_rag_retries_total", "counter", "RAG call retries.", [({}, stats["retries"])])
+        yield ("desiot_rag_failures_total", "counter", "RAG calls that failed after retries.", [({}, stats["failures"])])
+        yield ("desiot_rag_rejected_total", "counter", "RAG calls rejected by the breaker or the concurrency limit.", [({}, stats["rejected"])])
+        yield ("desiot_rag_breaker_open", "gauge", "1 while the RAG circuit breaker is not closed.", [({}, int(stats["breaker"] != "closed"))])
+    return collect
+
+
+def uplink_collector(uplink):
+    """Queue and delivery metrics from ThingSpeakUplink.stats()."""
+    def collect():
+        stats = uplink.stats()
+        yield ("desiot_uplink_queue_depth", "gauge", "Readings waiting for the next ThingSpeak batch.", [({}, stats["queue_depth"])])
+        yield ("desiot_uplink_spool_files", "gauge", "Batches spooled to disk for retry.", [({}, stats["spool_files"])])
+        yield ("desiot_uplink_sent_total", "counter", "Readings delivered to ThingSpeak.", [({}, stats["sent"])])
+        yield ("desiot_uplink_failures_total", "counter", "Failed ThingSpeak uploads.", [({}, stats["failures"])])
+        yield ("desiot_uplink_drops_total", "counter", "Readings dropped by the uplink.", [({}, stats["drops"])])
+        yield ("desiot_uplink_rejected_total", "counter", "Readings ThingSpeak rejected, kept in the rejected spool.", [({}, stats["rejected"])])
+    return collect
+
+
+def broadcaster_collector(broadcaster):
+    """Subscriber metrics from Broadcaster.stats()."""
+    def collect():
+        stats = broadcaster.stats()
+        yield ("desiot_stream_subscribers", "gauge", "Connected /sensor/stream clients.", [({}, stats["subscribers"])])
+        yield ("desiot_stream_published_total", "counter", "Events published to /sensor/stream.", [({}, stats["published"])])
+        yield ("desiot_stream_evictions_total", "counter", "Slow /sensor/stream clients disconnected.", [({}, stats["evictions"])])
+    return collect
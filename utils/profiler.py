@@ -0,0 +1,125 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Innermost Python functions of threads that are blocked rather than working.
+IDLE_FUNCTIONS = frozenset(("wait", "select", "poll", "accept", "sleep", "recv", "recv_into", "readinto", "_wait_for_tstate_lock"))
+# Shortest sampling interval start() accepts; below this the sampler thread just spins.
+MIN_INTERVAL = 0.001
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, max_depth=48, max_stacks=20000):
+        """Statistical profiler for a live process, off until start() is called.
+
+        A daemon thread samples the stack of every other thread each
+        `interval` seconds through sys._current_frames() and counts identical
+        stacks, so the overhead is one stack walk per thread per sample and
+        nothing at all while stopped. At most `max_stacks` distinct stacks
+        are kept; later new ones are counted under "[other]". Threads blocked
+        in IDLE_FUNCTIONS are only counted as idle, so the report shows where
+        the CPU time goes.
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _stack(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    if frame.f_code.co_name in IDLE_FUNCTIONS:
+                        self.idle += 1
+                        continue
+                    stack = self._stack(frame)
+                    if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                        stack = "[other]"
+                    self.stacks[stack] += 1
+                self.samples += 1
+            del frames
+
+    def start(self, interval=None):
+        """Clears previous samples and starts sampling. Returns False if already running.
+
+        Raises ValueError for an interval that is not finite or below MIN_INTERVAL.
+        """
+        if interval is not None and not (math.isfinite(interval) and interval >= MIN_INTERVAL):
+            raise ValueError(f"interval must be a number of seconds >= {MIN_INTERVAL}")
+        if self.running:
+            return False
+        if interval is not None:
+            self.interval = interval
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.idle = 0
+        self.started_at = time.time()
+        self.stopped_at = None
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="sampling-profiler")
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops sampling; the samples stay available until the next start()."""
+        if not self.running:
+            return False
+        self.stop_event.set()
+        self.thread.join()
+        self.stopped_at = time.time()
+        return True
+
+    def report(self, top=20):
+        """Returns the hottest stacks and the functions most often on top of a stack."""
+        with self.lock:
+            stacks = self.stacks.most_common()
+            samples = self.samples
+            idle = self.idle
+        total = sum(count for _, count in stacks) or 1
+        leaves = Counter()
+        for stack, count in stacks:
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": samples,
+            "idle_thread_samples": idle,
+            "duration": round(end - self.started_at, 3) if self.started_at else 0,
+            "top_functions": [{"function": name, "count": count, "percent": round(100 * count / total, 1)}
+                              for name, count in leaves.most_common(top)],
+            "top_stacks": [{"stack": stack.split(";"), "count": count, "percent": round(100 * count / total, 1)}
+                           for stack, count in stacks[:top]],
+        }
+
+    def collapsed(self):
+        """Returns the samples in the collapsed format flamegraph.pl and speedscope read."""
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
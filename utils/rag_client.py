@@ -1,15 +1,28 @@
-import requests
 import json
+from utils.response_cache import quantize, DEFAULT_BANDS
+from utils.rag_transport import RAGTransport
+from utils.air_quality import normal_answer, signature, summary_prompt
+from utils.log import get_logger
+
+log = get_logger("rag_client")
 
 class RAGClient:
-    def __init__(self, api_url="http://172.18.96.13:5678/webhook/desiotone/ragchat", recommendation_session_id="dc4eed223c5446f5935de3f83e363a06", chat_session_id="0f04b2f595af4c8d91e41f138798e03f", api_key=None):
-        """Initializes the RAG client with the API URL and key."""
+    def __init__(self, api_url="http://172.18.96.13:5678/webhook/desiotone/ragchat", recommendation_session_id="dc4eed223c5446f5935de3f83e363a06", chat_session_id="0f04b2f595af4c8d91e41f138798e03f", api_key=None, cache=None, bands=DEFAULT_BANDS, transport=None):
+        """Initializes the RAG client with the API URL and key.
+
+        With a utils.response_cache.ResponseCache, recommendations are cached
+        per reading quantized into `bands`. Upstream calls go through
+        `transport` (a pooled, timeout-bounded utils.rag_transport.RAGTransport
+        by default).
+        """
         self.api_url = api_url
         self.recommendation_session_id = recommendation_session_id
         self.chat_session_id = chat_session_id
+        self.cache = cache
+        self.bands = bands
+        self.transport = transport or RAGTransport()
     
-    def call_api(self, chat, sessionId):
-        """Calls the RAG API with the provided chat message."""
+    def _request(self, chat, sessionId):
         headers = {
             "Content-Type": "application/json"
         }
@@ -18,32 +31,96 @@ class RAGClient:
             "action": "sendMessage",
             "chatInput": chat
         }
+        return headers, json.dumps(body)
 
-        response = requests.post(self.api_url, headers=headers, data=json.dumps(body))
+    def call_api(self, chat, sessionId):
+        """Calls the RAG API with the provided chat message."""
+        headers, body = self._request(chat, sessionId)
+        response = self.transport.post(self.api_url, headers=headers, data=body)
         if response.status_code == 200:
             return response.json()
         else:
             response.raise_for_status()
     
-    def get_recommendation(self, data):
-        """Gets a recommendation based on the provided data."""
-        
+    def call_api_stream(self, chat, sessionId):
+        """Calls the RAG API and yields text chunks as the webhook produces them.
+
+        A webhook with streaming enabled answers with newline-delimited JSON
+        events ({"type": "item", "content": ...}); any other answer is relayed
+        as one chunk once it is complete.
+        """
+        headers, body = self._request(chat, sessionId)
+        buffered = []
+        for line in self.transport.stream(self.api_url, headers=headers, data=body):
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                buffered.append(line)
+                continue
+            if isinstance(event, dict) and "type" in event:
+                if event["type"] == "item" and event.get("content"):
+                    yield event["content"]
+                elif event["type"] == "error":
+                    raise RuntimeError(event.get("content") or "RAG stream failed")
+            else:
+                buffered.append(line)
+
+        if buffered:
+            # Not an event stream: the body is the usual [{"output": ...}] answer.
+            answer = json.loads(b"\n".join(buffered))
+            if isinstance(answer, list) and answer:
+                answer = answer[0]
+            yield answer.get("output") if isinstance(answer, dict) else str(answer)
+
+    def get_recommendation(self, data, report=None):
+        """Gets a recommendation based on the provided data, reusing cached advice for near-identical readings.
+
+        With a `report` from utils.air_quality.AirQualityAnalyzer, a normal
+        reading is answered locally and only the abnormal findings are sent
+        to the RAG API.
+        """
+        if report is not None:
+            if report["status"] == "normal":
+                return normal_answer(report)
+            compute = lambda: self._get_triaged_recommendation(report)
+            key = (quantize(data, self.bands), signature(report))
+        else:
+            compute = lambda: self._get_recommendation(data)
+            key = quantize(data, self.bands)
+        if self.cache is None:
+            return compute()
+        return self.cache.get_or_compute(key, compute)
+
+    def _get_recommendation(self, data):
+        """Asks the RAG API for a recommendation for one reading."""
         temp = data.get("temperature", 0.0)
         humid = data.get("humidity", 0.0)
         eco2 = data.get("eco2", 0)
         tvoc = data.get("tvoc", 0)
         aqi = data.get("aqi", 0)
 
-        print(f"[RAG_CLIENT][INFO] Getting recommendation for data: {data}")
+        log.info("Getting recommendation for data: %s", data)
 
         data = {"data": {"temperature": {temp}, "humidity": {humid}, "eco2": {eco2}, "tvoc": {tvoc}, "aqi": {aqi}}}
         return self.call_api(f"given air quality data: {data}. analyze each parameters whether its normal or too low or too high, if they're not normal, you have to specify it in your response and give some known consequence of such abnormal parameter (if found in the vector database) and also give actionable recommentations to the user such as opening window, turning up the integrated humidifier or purifier fan, clean the room using vacoom cleaner, etc", self.recommendation_session_id)[0].get("output")
 
+    def _get_triaged_recommendation(self, report):
+        """Asks the RAG API about the abnormal findings of an analyzer report only."""
+        log.info("Getting recommendation for findings: %s", signature(report))
+        return self.call_api(summary_prompt(report), self.recommendation_session_id)[0].get("output")
+
     def chat(self, message):
         """Sends a chat message to the RAG API."""
-        print(f"[RAG_CLIENT][INFO] Sending chat message: {message}")
+        log.info("Sending chat message: %s", message)
         return self.call_api(message, self.chat_session_id)[0].get("output")
 
+    def chat_stream(self, message):
+        """Sends a chat message to the RAG API and yields the answer in chunks."""
+        log.info("Streaming chat message: %s", message)
+        return self.call_api_stream(message, self.chat_session_id)
+
 if __name__ == "__main__":
     client = RAGClient()
     sample_data = {
@@ -0,0 +1,192 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from utils.metrics import REGISTRY, SLOW_BUCKETS
+
+REQUEST_SECONDS = REGISTRY.histogram("desiot_rag_request_seconds", "RAG webhook call duration including retries; streams until the last line.",
+                                     labels=("mode", "outcome"), buckets=SLOW_BUCKETS)
+FIRST_LINE_SECONDS = REGISTRY.histogram("desiot_rag_first_line_seconds", "Time until a streamed RAG answer produced its first line.",
+                                        buckets=SLOW_BUCKETS)
+
+# Upstream statuses worth another attempt besides 5xx; anything else is returned as is.
+RETRY_STATUSES = (429,)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class TransportBusyError(RuntimeError):
+    """Raised when every upstream slot stays taken for longer than the acquire timeout."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """Opens after `failure_threshold` consecutive failures and lets one trial call through after `reset_timeout` seconds."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """Returns True if a call may go upstream now."""
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def release_trial(self):
+        """Gives back a half-open trial that was allowed but never made."""
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RAGTransport:
+    def __init__(self, pool_size=8, connect_timeout=3.05, read_timeout=60, max_retries=2, backoff=0.5,
+                 max_backoff=5, max_concurrent=4, acquire_timeout=5, failure_threshold=5, reset_timeout=30):
+        """HTTP transport for the RAG webhook.
+
+        Calls share one keep-alive requests.Session, are bounded by connect
+        and read timeouts, and retry connection failures and 429/5xx responses
+        up to `max_retries` times with full-jitter exponential backoff.
+        Read timeouts are not retried so one slow LLM answer is never paid
+        for twice. At most `max_concurrent` calls run upstream at once; others
+        wait up to `acquire_timeout` seconds and then fail fast, as do all
+        calls while the circuit breaker is open.
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.acquire_timeout = acquire_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def post(self, url, **kwargs):
+        """POSTs through the breaker, the concurrency limit and the retry policy. Returns the response."""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError("RAG service is unavailable, circuit breaker is open")
+        if not self.slots.acquire(timeout=self.acquire_timeout):
+            self.rejected += 1
+            self.breaker.release_trial()
+            raise TransportBusyError("Too many concurrent RAG requests")
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = self._post_with_retries(url, **kwargs)
+            if response.status_code < 400:
+                outcome = "ok"
+            return response
+        finally:
+            self.slots.release()
+            REQUEST_SECONDS.labels("post", outcome).observe(time.perf_counter() - start)
+
+    def stream(self, url, chunk_size=None, **kwargs):
+        """POSTs like post() and yields response lines as they arrive.
+
+        The concurrency slot is held until the body is fully read or the
+        generator is closed. Only the request phase is retried.
+        """
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError("RAG service is unavailable, circuit breaker is open")
+        if not self.slots.acquire(timeout=self.acquire_timeout):
+            self.rejected += 1
+            self.breaker.release_trial()
+            raise TransportBusyError("Too many concurrent RAG requests")
+        start = time.perf_counter()
+        outcome = "aborted"  # the consumer closed the generator early
+        try:
+            response = self._post_with_retries(url, stream=True, **kwargs)
+            try:
+                response.raise_for_status()
+                first = True
+                for line in response.iter_lines(chunk_size=chunk_size or 512):
+                    if first:
+                        FIRST_LINE_SECONDS.observe(time.perf_counter() - start)
+                        first = False
+                    yield line
+                outcome = "ok"
+            finally:
+                response.close()
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self.slots.release()
+            REQUEST_SECONDS.labels("stream", outcome).observe(time.perf_counter() - start)
+
+    def _post_with_retries(self, url, **kwargs):
+        self.calls += 1
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.post(url, timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout):
+                if last_attempt:
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    raise
+            except requests.exceptions.RequestException:
+                self.failures += 1
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES and response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                if last_attempt:
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    return response
+            self.retries += 1
+            time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "breaker": self.breaker.state,
+        }
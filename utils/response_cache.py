@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Band widths used to quantize readings into cache keys, in sensor units.
+DEFAULT_BANDS = {"temperature": 0.5, "humidity": 2.0, "eco2": 50, "tvoc": 25, "aqi": 1}
+
+
+def quantize(data, bands=DEFAULT_BANDS):
+    """Maps a reading onto its band indices, so near-identical readings share a key."""
+    return tuple((name, int((data.get(name, 0) or 0) // width)) for name, width in sorted(bands.items()))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    def __init__(self, maxsize=256, ttl=600):
+        """LRU cache with a per-entry TTL and single-flight computation.
+
+        Concurrent get_or_compute() calls for a key that is not cached share
+        one call of `compute`; the others wait for its result.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.inflight = {}  # key -> _Flight
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for `key`, computing it at most once across threads."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+
+            flight = self.inflight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self.inflight[key] = _Flight()
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+                if flight.error is None:
+                    self.entries[key] = (time.monotonic() + self.ttl, flight.value)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.maxsize:
+                        self.entries.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            size = len(self.entries)
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+        }
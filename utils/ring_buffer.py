@@ -0,0 +1,113 @@
+import numpy as np
+from datetime import datetime
+
+# Column layout shared by everything that stores sensor history.
+# timestamp is seconds since the epoch, the rest mirror the ESP32 JSON keys.
+FIELDS = (
+    ("temperature", np.float32),
+    ("humidity", np.float32),
+    ("eco2", np.int32),
+    ("tvoc", np.int32),
+    ("aqi", np.int32),
+)
+FIELD_NAMES = tuple(name for name, _ in FIELDS)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def format_timestamp(epoch):
+    """Formats an epoch timestamp the same way Esp32.latest_timestamp is formatted."""
+    return datetime.fromtimestamp(int(epoch)).strftime(TIMESTAMP_FORMAT)
+
+
+def columns_to_records(columns):
+    """Converts a dict of column arrays into the list-of-dicts shape the API returns."""
+    timestamps = columns["timestamp"].tolist()
+    values = {}
+    for name, column in columns.items():
+        if name == "timestamp":
+            continue
+        if column.dtype.kind == "f":
+            # float32 -> float64 would otherwise surface as 22.299999237060547
+            column = np.round(column.astype(np.float64), 3)
+        values[name] = column.tolist()
+    records = []
+    for i, ts in enumerate(timestamps):
+        record = {name: col[i] for name, col in values.items()}
+        record["timestamp"] = format_timestamp(ts)
+        records.append(record)
+    return records
+
+
+class RingBuffer:
+    def __init__(self, capacity):
+        """Preallocates one array per field plus an int64 epoch timestamp column.
+
+        Every value is written twice, at slot i and i + capacity, so the most
+        recent `capacity` samples are always one contiguous slice and windows
+        can be handed out as views instead of copies.
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.timestamp = np.zeros(2 * capacity, dtype=np.int64)
+        self.columns = {name: np.zeros(2 * capacity, dtype=dtype) for name, dtype in FIELDS}
+        self.head = 0  # slot that receives the next sample
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, data):
+        """Stores one sample in O(1) without allocating."""
+        i = self.head
+        j = i + self.capacity
+        self.timestamp[i] = self.timestamp[j] = timestamp
+        for name, column in self.columns.items():
+            column[i] = column[j] = data.get(name, 0)
+
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _window(self):
+        """Returns the (start, stop) slot range holding the stored samples, oldest first."""
+        if self.count < self.capacity:
+            return 0, self.count
+        return self.head, self.head + self.capacity
+
+    def view(self, last=None):
+        """Returns zero-copy views of every column, oldest sample first.
+
+        `last` limits the window to the most recent N samples.
+        """
+        start, stop = self._window()
+        if last is not None:
+            start = max(start, stop - last)
+        view = {"timestamp": self.timestamp[start:stop]}
+        for name, column in self.columns.items():
+            view[name] = column[start:stop]
+        return view
+
+    def time_range(self):
+        """Returns the (first, last) stored timestamps, or None when empty."""
+        if not self.count:
+            return None
+        timestamps = self.view()["timestamp"]
+        return int(timestamps[0]), int(timestamps[-1])
+
+    def query(self, start_ts=None, end_ts=None, limit=None):
+        """Returns views of the samples whose timestamp lies in [start_ts, end_ts].
+
+        With `limit`, only the most recent `limit` matching samples are returned.
+        """
+        view = self.view()
+        timestamps = view["timestamp"]
+        lo = 0 if start_ts is None else np.searchsorted(timestamps, start_ts, side="left")
+        hi = len(timestamps) if end_ts is None else np.searchsorted(timestamps, end_ts, side="right")
+        if limit is not None:
+            lo = max(lo, hi - limit)
+        return {name: column[lo:hi] for name, column in view.items()}
+
+    def to_records(self, last=None):
+        """Returns the stored samples as a list of dicts, oldest first."""
+        return columns_to_records(self.view(last))
@@ -0,0 +1,160 @@
+import os
+import threading
+import numpy as np
+from utils.ring_buffer import FIELD_NAMES
+
+# (resolution in seconds, number of buckets retained)
+LEVELS = (
+    (60, 7 * 24 * 60),   # 1 minute buckets for a week
+    (3600, 366 * 24),    # 1 hour buckets for a year
+    (86400, 10 * 366),   # 1 day buckets for ten years
+)
+
+ROLLUP_DTYPE = np.dtype([
+    ("timestamp", "<i8"),
+    ("count", "<i8"),
+    ("sum", "<f8", (len(FIELD_NAMES),)),
+    ("sumsq", "<f8", (len(FIELD_NAMES),)),
+    ("min", "<f8", (len(FIELD_NAMES),)),
+    ("max", "<f8", (len(FIELD_NAMES),)),
+])
+
+
+class Rollup:
+    def __init__(self, resolution, capacity, path=None, readonly=False):
+        """Keeps count, sum, sum of squares, min and max per field for fixed-width time buckets.
+
+        Buckets live in a ring of `capacity` slots. With `path` the ring is a
+        memory-mapped .npy file, so rollups survive restarts without replaying
+        raw history. A `readonly` rollup maps an existing file written by
+        another process and re-locates the newest bucket before every query.
+        """
+        self.resolution = resolution
+        self.capacity = capacity
+        self.readonly = readonly
+
+        if readonly:
+            self.slots = np.load(os.path.join(path, f"rollup-{resolution}s.npy"), mmap_mode="r")
+            if self.slots.dtype != ROLLUP_DTYPE:
+                raise ValueError(f"Unexpected rollup layout in {path}")
+            self.capacity = len(self.slots)
+        elif path is None:
+            self.slots = np.zeros(capacity, dtype=ROLLUP_DTYPE)
+        else:
+            os.makedirs(path, exist_ok=True)
+            file = os.path.join(path, f"rollup-{resolution}s.npy")
+            slots = np.load(file, mmap_mode="r+") if os.path.exists(file) else None
+            if slots is None or slots.dtype != ROLLUP_DTYPE or slots.shape != (capacity,):
+                slots = np.lib.format.open_memmap(file, mode="w+", dtype=ROLLUP_DTYPE, shape=(capacity,))
+            self.slots = slots
+
+        # Column views, so updates never go through structured scalars.
+        self.timestamp = self.slots["timestamp"]
+        self.count = self.slots["count"]
+        self.sum = self.slots["sum"]
+        self.sumsq = self.slots["sumsq"]
+        self.min = self.slots["min"]
+        self.max = self.slots["max"]
+
+        self._locate()
+
+    def _locate(self):
+        """Finds the number of used slots and the newest one from the timestamps alone."""
+        used = np.count_nonzero(self.timestamp)
+        self.size = int(used)
+        self.head = int(np.argmax(self.timestamp)) if used else -1
+
+    def update(self, timestamp, values):
+        """Folds one sample (float64 array ordered like FIELD_NAMES) into its bucket in O(1)."""
+        bucket = timestamp - timestamp % self.resolution
+        if self.size and bucket < self.timestamp[self.head]:
+            return  # late sample for a bucket that has already been closed
+
+        if not self.size or bucket > self.timestamp[self.head]:
+            h = (self.head + 1) % self.capacity
+            self.timestamp[h] = bucket
+            self.count[h] = 0
+            self.sum[h] = 0.0
+            self.sumsq[h] = 0.0
+            self.min[h] = np.inf
+            self.max[h] = -np.inf
+            self.head = h
+            self.size = min(self.size + 1, self.capacity)
+
+        h = self.head
+        self.count[h] += 1
+        self.sum[h] += values
+        self.sumsq[h] += values * values
+        np.minimum(self.min[h], values, out=self.min[h])
+        np.maximum(self.max[h], values, out=self.max[h])
+
+    def oldest(self):
+        """Returns the start of the oldest retained bucket, or None when empty."""
+        if self.readonly:
+            self._locate()
+        if not self.size:
+            return None
+        return int(self.timestamp[(self.head + 1 - self.size) % self.capacity])
+
+    def query(self, start_ts=None, end_ts=None):
+        """Returns the buckets overlapping [start_ts, end_ts] in time order."""
+        if self.readonly:
+            self._locate()
+        order = (np.arange(self.size) + self.head + 1 - self.size) % self.capacity
+        timestamps = self.timestamp[order]
+        lo = 0 if start_ts is None else np.searchsorted(timestamps, start_ts - start_ts % self.resolution, side="left")
+        hi = len(timestamps) if end_ts is None else np.searchsorted(timestamps, end_ts, side="right")
+        order = order[lo:hi]
+        return {
+            "timestamp": self.timestamp[order],
+            "count": self.count[order],
+            "sum": self.sum[order],
+            "sumsq": self.sumsq[order],
+            "min": self.min[order],
+            "max": self.max[order],
+        }
+
+    def flush(self):
+        """Flushes a memory-mapped rollup to disk."""
+        if isinstance(self.slots, np.memmap) and not self.readonly:
+            self.slots.flush()
+
+
+class Rollups:
+    def __init__(self, path=None, levels=LEVELS, readonly=False):
+        """Maintains one Rollup per resolution in `levels`, finest first."""
+        self.levels = [Rollup(resolution, capacity, path, readonly) for resolution, capacity in levels]
+        self.lock = threading.Lock()
+
+    def update(self, timestamp, data):
+        """Folds one reading into every resolution."""
+        values = np.array([data.get(name, 0) for name in FIELD_NAMES], dtype=np.float64)
+        with self.lock:
+            for level in self.levels:
+                level.update(int(timestamp), values)
+
+    def covering(self, start_ts):
+        """Returns the levels that still hold the bucket containing start_ts, finest first."""
+        levels = []
+        for level in self.levels:
+            oldest = level.oldest()
+            if oldest is not None and oldest <= start_ts - start_ts % level.resolution:
+                levels.append(level)
+        return levels
+
+    def select(self, bucket, start_ts):
+        """Returns the coarsest rollup whose buckets nest inside `bucket` and that covers start_ts, or None."""
+        for level in reversed(self.covering(start_ts)):
+            if not bucket % level.resolution:
+                return level
+        return None
+
+    def query(self, level, start_ts=None, end_ts=None):
+        """Returns bucket columns from `level` under the update lock."""
+        with self.lock:
+            return level.query(start_ts, end_ts)
+
+    def flush(self):
+        with self.lock:
+            for level in self.levels:
+                level.flush()
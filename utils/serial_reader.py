@@ -0,0 +1,108 @@
+import json
+import math
+import queue
+import numpy as np
+from utils.ring_buffer import FIELDS
+
+DROP_OLDEST = "oldest"
+DROP_NEWEST = "newest"
+INT32_LIMIT = 2 ** 31
+FLOAT32_LIMIT = float(np.finfo(np.float32).max)
+# (field, stored as an integer) in FIELDS order, for to_sample().
+SAMPLE_FIELDS = tuple((name, np.dtype(dtype).kind == "i") for name, dtype in FIELDS)
+
+
+def to_sample(data):
+    """Converts every FIELDS value of a decoded frame to a finite number of its column type, in place.
+
+    ArduinoJson sends a failed sensor read (NaN) as null, so a reading is
+    only accepted when all fields are present and numeric. Returns None for
+    anything else, before any of it reaches the history or the rollups.
+    """
+    for name, integer in SAMPLE_FIELDS:
+        value = data.get(name)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        if integer:
+            value = int(round(value))
+            if not -INT32_LIMIT <= value < INT32_LIMIT:
+                return None
+        elif abs(value) > FLOAT32_LIMIT:
+            return None
+        data[name] = value if integer else float(value)
+    return data
+
+
+def parse_frame(frame):
+    """Decodes one JSON object frame, recovering from leading garbage.
+
+    Returns None when no object can be recovered or it is not a valid
+    reading (see to_sample).
+    """
+    try:
+        data = json.loads(frame)
+    except (ValueError, UnicodeDecodeError):
+        # A reset or dropped bytes can leave the tail of an earlier frame in
+        # front of a good one; retry from the last opening brace.
+        brace = frame.rfind(b"{")
+        if brace <= 0:
+            return None
+        try:
+            data = json.loads(frame[brace:])
+        except (ValueError, UnicodeDecodeError):
+            return None
+    return to_sample(data) if isinstance(data, dict) else None
+
+
+def put_with_policy(q, item, drop_policy):
+    """Queues `item` without blocking. Returns True if a sample had to be dropped."""
+    try:
+        q.put_nowait(item)
+        return False
+    except queue.Full:
+        pass
+    if drop_policy == DROP_NEWEST:
+        return True
+    try:
+        q.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        q.put_nowait(item)
+    except queue.Full:
+        pass
+    return True
+
+
+class LineFramer:
+    def __init__(self, max_frame=1024):
+        """Splits a byte stream into newline-terminated frames using one reusable bytearray.
+
+        Frames longer than `max_frame` without a newline are discarded as garbage.
+        """
+        self.max_frame = max_frame
+        self.buffer = bytearray()
+        self.overflows = 0
+
+    def feed(self, chunk):
+        """Appends `chunk` and returns the complete, stripped, non-empty frames it finished."""
+        self.buffer += chunk
+        frames = []
+        start = 0
+        while True:
+            end = self.buffer.find(b"\n", start)
+            if end < 0:
+                break
+            frame = bytes(self.buffer[start:end]).strip()
+            if frame:
+                frames.append(frame)
+            start = end + 1
+        if start:
+            del self.buffer[:start]
+        if len(self.buffer) > self.max_frame:
+            # No newline in sight, the stream is garbled; resynchronise on the next one.
+            self.overflows += 1
+            self.buffer.clear()
+        return frames
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+from utils.ts_store import TimeSeriesStore
+from utils.rollup import Rollups
+from utils.snapshot import SnapshotFile
+from utils.anomaly import AnomalyLog
+from utils.event_file import EventFollower
+from utils.hub_manager import UnknownDeviceError, NoDeviceError
+from utils.log import get_logger
+
+log = get_logger("shared_hub")
+
+
+class SharedDevice:
+    def __init__(self, data_dir, device_id):
+        """Read-only view of one device written by the ingest process.
+
+        Exposes the parts of Esp32 the web endpoints use: latest, device_id,
+        rollups, anomalies, query(), time_range() and get_latest_data().
+        """
+        self.device_id = device_id
+        self.store = TimeSeriesStore(path=os.path.join(data_dir, "history", device_id), readonly=True)
+        self.rollups_path = os.path.join(data_dir, "rollups", device_id)
+        self._rollups = None
+        self.anomalies = AnomalyLog(path=os.path.join(data_dir, "anomalies", f"{device_id}.jsonl"), readonly=True)
+        self.snapshot_file = SnapshotFile(os.path.join(data_dir, "latest", f"{device_id}.json"), device_id)
+
+    @property
+    def rollups(self):
+        # The ingest process may create the rollup files after this worker started.
+        if self._rollups is None:
+            try:
+                self._rollups = Rollups(path=self.rollups_path, readonly=True)
+            except (FileNotFoundError, ValueError):
+                return None
+        return self._rollups
+
+    @property
+    def latest(self):
+        return self.snapshot_file.read()
+
+    def get_latest_data(self):
+        snapshot = self.latest
+        return dict(snapshot.data) if snapshot is not None else {}
+
+    def query(self, start_ts=None, end_ts=None, limit=None):
+        return self.store.query(start_ts, end_ts, limit=limit)
+
+    def time_range(self):
+        return self.store.time_range()
+
+
+class SharedHub:
+    def __init__(self, data_dir="data", broadcaster=None, poll_interval=0.1):
+        """HubManager stand-in for web workers that do not own the serial ports.
+
+        Devices are the ones the ingest process has published a latest
+        snapshot for under `data_dir`/latest, and stats() returns the hub
+        stats it publishes to `data_dir`/stats.json. With a `broadcaster`,
+        start() follows the event file the ingest process appends every
+        accepted reading and anomaly event to (see utils.event_file) and
+        republishes them to this worker's /sensor/stream subscribers.
+        """
+        self.data_dir = data_dir
+        self.latest_dir = os.path.join(data_dir, "latest")
+        self.stats_path = os.path.join(data_dir, "stats.json")
+        self.events_path = os.path.join(data_dir, "events", "events.jsonl")
+        self.broadcaster = broadcaster
+        self.poll_interval = poll_interval
+        self.devices = {}
+        self.lock = threading.Lock()
+
+    def _scan(self):
+        try:
+            names = os.listdir(self.latest_dir)
+        except FileNotFoundError:
+            names = []
+        device_ids = {name[:-len(".json")] for name in names if name.endswith(".json")}
+        with self.lock:
+            for device_id in device_ids - self.devices.keys():
+                self.devices[device_id] = SharedDevice(self.data_dir, device_id)
+            return sorted(device_ids)
+
+    def device_ids(self):
+        return self._scan()
+
+    def get(self, device_id=None):
+        """Returns the SharedDevice for `device_id`, or the first device when it is omitted.
+
+        Raises UnknownDeviceError for an unknown id and NoDeviceError when no device has data yet.
+        """
+        device_ids = self._scan()
+        if device_id:
+            if device_id not in device_ids:
+                raise UnknownDeviceError(device_id)
+            return self.devices[device_id]
+        if not device_ids:
+            raise NoDeviceError("No ESP32 device attached")
+        return self.devices[device_ids[0]]
+
+    def stats(self):
+        """Returns the last HubManager.stats() the ingest process published, with its age in seconds."""
+        try:
+            with open(self.stats_path) as f:
+                stats = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"devices": {device_id: {} for device_id in self._scan()}, "age": None}
+        stats["age"] = round(time.time() - stats.pop("updated_at"), 1)
+        return stats
+
+    def _poll_forever(self):
+        follower = EventFollower(self.events_path)
+        while True:
+            try:
+                for topic, event, data in follower.poll():
+                    self.broadcaster.publish(data, topic=topic, event=event)
+            except Exception as e:
+                log.error("Poll failed: %s", e)
+            time.sleep(self.poll_interval)
+
+    def start(self):
+        """Starts relaying the ingest process's events to the broadcaster, if there is one."""
+        if self.broadcaster is not None:
+            threading.Thread(target=self._poll_forever, daemon=True, name="shared-hub").start()
+        return self
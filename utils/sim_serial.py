@@ -0,0 +1,179 @@
+import json
+import os
+import pty
+import random
+import threading
+import time
+import tty
+from urllib.parse import parse_qsl
+
+# Port specs handled here instead of by pyserial:
+#   sim:<name>?rate=200&jitter=0.2&malformed=0.01&seed=1&count=1000
+#   replay:<path>?rate=50&loop=1
+#   pty:<name>   (frames are written by the caller through PtyTransport.write)
+SCHEMES = ("sim", "replay", "pty")
+
+MALFORMED_FRAMES = (
+    b'{"temperature": 23.1, "humidity": 4',
+    b"\xff\xfe\x00garbage",
+    b"ets Jun  8 2016 00:22:57 rst:0x1 (POWERON_RESET)",
+    b'{"temperature": }',
+)
+
+
+def parse_spec(spec):
+    """Splits a simulated port spec into (scheme, target, options); returns None for a real port."""
+    scheme, sep, rest = spec.partition(":")
+    if not sep or scheme not in SCHEMES:
+        return None
+    target, _, query = rest.partition("?")
+    return scheme, target, dict(parse_qsl(query))
+
+
+def transport_id(spec):
+    """Returns the device id for a port: the sim/pty name, the replay file name, or the device name."""
+    parsed = parse_spec(spec)
+    if parsed is None:
+        return spec.rsplit("/", 1)[-1]
+    scheme, target, _ = parsed
+    if scheme == "replay":
+        return os.path.splitext(os.path.basename(target))[0] or "replay"
+    return target or scheme
+
+
+def synthetic_frames(seed=None, count=None):
+    """Yields ESP32-like readings that drift slowly, like a room over a day."""
+    rng = random.Random(seed)
+    temperature, humidity, eco2, tvoc = 23.0, 45.0, 600.0, 50.0
+    i = 0
+    while count is None or i < count:
+        temperature = min(max(temperature + rng.gauss(0, 0.02), 15), 35)
+        humidity = min(max(humidity + rng.gauss(0, 0.1), 15), 90)
+        eco2 = min(max(eco2 + rng.gauss(0, 4), 400), 3000)
+        tvoc = min(max(tvoc + rng.gauss(0, 2), 0), 1500)
+        aqi = 1 if eco2 < 800 else 2 if eco2 < 1000 else 3 if eco2 < 1500 else 4
+        yield {"temperature": round(temperature, 2), "humidity": round(humidity, 2),
+               "eco2": int(eco2), "tvoc": int(tvoc), "aqi": aqi}
+        i += 1
+
+
+def replay_frames(path, loop=False):
+    """Yields the lines of a recorded serial log: JSON lines as dicts, anything else as raw bytes."""
+    while True:
+        with open(path, "rb") as f:
+            for line in f:
+                line = line.rstrip(b"\r\n")
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    yield line
+                    continue
+                yield data if isinstance(data, dict) else line
+        if not loop:
+            return
+
+
+class PtyTransport:
+    def __init__(self, frames=None, rate=0, jitter=0.0, malformed=0.0, seed=None):
+        """A pseudo-terminal pair standing in for an ESP32 USB serial port.
+
+        Open `path` like any serial device. With `frames` (an iterable of
+        dicts or raw bytes) a writer thread sends one line per frame at `rate`
+        frames per second (0: as fast as the reader drains the pty), each gap
+        varied by up to +/-`jitter` of the period. A `malformed` fraction of
+        frames is replaced by a truncated or garbage line. Every JSON frame
+        carries a "sent" epoch so consumers can measure ingest latency.
+        """
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.frames = frames
+        self.rate = rate
+        self.jitter = jitter
+        self.malformed = malformed
+        self.rng = random.Random(seed)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.sent = 0
+        self.malformed_sent = 0
+        self.bytes_sent = 0
+
+    def write(self, data):
+        """Writes raw bytes to the device side, blocking while the pty buffer is full."""
+        view = memoryview(data)
+        while view:
+            written = os.write(self.master, view)
+            view = view[written:]
+        self.bytes_sent += len(data)
+
+    def send(self, frame):
+        """Writes one frame as a line, corrupting it with probability `malformed`."""
+        if self.malformed and self.rng.random() < self.malformed:
+            line = self.rng.choice(MALFORMED_FRAMES)
+            self.malformed_sent += 1
+        elif isinstance(frame, dict):
+            line = json.dumps({**frame, "sent": time.time()}).encode()
+        else:
+            line = frame
+        self.write(line + b"\n")
+        self.sent += 1
+
+    def _run(self):
+        period = 1.0 / self.rate if self.rate else 0.0
+        deadline = time.perf_counter()
+        try:
+            for frame in self.frames:
+                if self.stop_event.is_set():
+                    return
+                if period:
+                    # Absolute deadlines, so the average rate does not drift with sleep overshoot.
+                    deadline += period * (1 + self.rng.uniform(-self.jitter, self.jitter))
+                    delay = deadline - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.send(frame)
+        except OSError:
+            pass  # closed underneath the writer
+
+    def start(self):
+        if self.frames is not None and self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True, name=f"pty-{self.path}")
+            self.thread.start()
+        return self
+
+    def close(self):
+        self.stop_event.set()
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"path": self.path, "sent": self.sent, "malformed": self.malformed_sent, "bytes": self.bytes_sent}
+
+
+def open_transport(spec):
+    """Starts the PtyTransport for a simulated port spec, or returns None for a real port."""
+    parsed = parse_spec(spec)
+    if parsed is None:
+        return None
+    scheme, target, options = parsed
+    seed = options.get("seed")
+    count = options.get("count")
+    if scheme == "sim":
+        frames = synthetic_frames(seed=seed, count=int(count) if count else None)
+    elif scheme == "replay":
+        frames = replay_frames(target, loop=options.get("loop", "0").lower() in ("1", "true", "yes"))
+    else:
+        frames = None
+    return PtyTransport(
+        frames,
+        rate=float(options.get("rate", 10 if scheme == "sim" else 0)),
+        jitter=float(options.get("jitter", 0)),
+        malformed=float(options.get("malformed", 0)),
+        seed=seed,
+    ).start()
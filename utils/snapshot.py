@@ -0,0 +1,65 @@
+import itertools
+import json
+import os
+from types import MappingProxyType
+from utils.fileio import atomic_write
+
+# Distinguishes ETags across restarts, since sequence numbers start over.
+BOOT_ID = os.urandom(4).hex()
+# One sequence for the whole process: a re-attached device gets a new Esp32
+# whose readings must not reuse the ETags of the one it replaced.
+SEQUENCE = itertools.count(1)
+
+
+class Snapshot:
+    __slots__ = ("seq", "data", "etag", "boot_id", "_body")
+
+    def __init__(self, seq, data, device_id=None, boot_id=BOOT_ID):
+        """An immutable latest reading.
+
+        Readers take `Esp32.latest` once and see one consistent sample; the
+        writer publishes a new Snapshot by swapping that single reference.
+        The /sensor/latest response body is encoded lazily, once per snapshot.
+        """
+        self.seq = seq
+        self.data = MappingProxyType(dict(data))
+        self.boot_id = boot_id
+        self.etag = f"{boot_id}.{device_id or ''}.{seq}"
+        self._body = None
+
+    @property
+    def body(self):
+        """The encoded {"status": "success", "data": ...} response, shared by every request."""
+        body = self._body
+        if body is None:
+            # Two threads may race to encode; both produce the same bytes.
+            body = self._body = json.dumps({"status": "success", "data": dict(self.data)}).encode()
+        return body
+
+
+def write_snapshot(path, snapshot):
+    """Atomically replaces `path` with the snapshot, for web workers in other processes."""
+    atomic_write(path, json.dumps({"boot_id": snapshot.boot_id, "seq": snapshot.seq, "data": dict(snapshot.data)}))
+
+
+class SnapshotFile:
+    def __init__(self, path, device_id=None):
+        """Reads snapshots written by write_snapshot(), re-parsing only when the file was replaced."""
+        self.path = path
+        self.device_id = device_id
+        self.stamp = None
+        self.snapshot = None
+
+    def read(self):
+        """Returns the current Snapshot, or None if none has been written yet."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self.snapshot
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp != self.stamp:
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.snapshot = Snapshot(saved["seq"], saved["data"], self.device_id, saved["boot_id"])
+            self.stamp = stamp
+        return self.snapshot
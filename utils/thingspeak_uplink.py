@@ -0,0 +1,201 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+from utils.fileio import atomic_write
+from utils.serial_reader import put_with_policy, DROP_OLDEST
+from utils.log import get_logger
+
+log = get_logger("uplink")
+
+BULK_UPDATE_URL = "https://api.thingspeak.com/channels/{channel_id}/bulk_update.json"
+# Outcomes of one bulk-update request.
+SENT = "sent"
+RETRY = "retry"  # 429, 5xx or a network error: back off and send again later
+REJECTED = "rejected"  # any other 4xx: sending the same batch again cannot succeed
+
+# field1..field5 in the order the original per-reading upload used.
+FIELD_MAP = (("field1", "temperature"), ("field2", "humidity"), ("field3", "eco2"), ("field4", "tvoc"), ("field5", "aqi"))
+
+
+def to_update(timestamp, data):
+    """Converts one reading into a ThingSpeak bulk-update entry."""
+    update = {"created_at": datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}
+    for field, name in FIELD_MAP:
+        if name in data:
+            update[field] = data[name]
+    if data.get("device"):
+        update["status"] = data["device"]
+    return update
+
+
+class ThingSpeakUplink(threading.Thread):
+    def __init__(self, write_api_key, channel_id, interval=15, max_batch=960, queue_size=10000,
+                 spool_dir="data/uplink_spool", max_spool_files=10000, timeout=(3.05, 10), max_backoff=600):
+        """Uploads readings to ThingSpeak in the background.
+
+        submit() only enqueues, so ingest never waits on the network. Every
+        `interval` seconds (ThingSpeak's rate limit) the worker sends one
+        bulk-update request over a pooled session: the oldest spooled batches
+        if there are any, otherwise up to `max_batch` queued readings. Batches
+        that fail, or that arrive while backing off, are written to
+        `spool_dir` and drained oldest first once uploads succeed again.
+        Batches ThingSpeak rejects with a 4xx other than 429 are moved to
+        `spool_dir`/rejected instead, so one bad batch cannot stall the rest.
+        """
+        super().__init__(daemon=True, name="thingspeak-uplink")
+        self.write_api_key = write_api_key
+        self.url = BULK_UPDATE_URL.format(channel_id=channel_id)
+        self.interval = interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.spool_dir = spool_dir
+        self.rejected_dir = os.path.join(spool_dir, "rejected")
+        self.max_spool_files = max_spool_files
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        os.makedirs(self.rejected_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.running = threading.Event()
+        self.backoff = 0
+        self.retry_at = 0.0
+
+        self.sent = 0
+        self.failures = 0
+        self.drops = 0
+        self.spooled = 0
+        self.spool_evictions = 0
+        self.rejected = 0
+
+    def submit(self, timestamp, data):
+        """Queues one reading for upload without blocking."""
+        if put_with_policy(self.queue, to_update(timestamp, data), DROP_OLDEST):
+            self.drops += 1
+
+    def stop(self):
+        self.running.clear()
+
+    def run(self):
+        self.running.set()
+        while self.running.is_set():
+            started = time.monotonic()
+            try:
+                self._tick()
+            except Exception as e:
+                log.error("%s", e)
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _tick(self):
+        """Sends at most one request, respecting the rate limit and the current backoff."""
+        batch = self._drain()
+        if time.monotonic() < self.retry_at:
+            self._spool(batch)
+            return
+
+        spool_files = self._spool_files()
+        if spool_files:
+            # Keep ordering: new readings wait behind older spooled ones.
+            self._spool(batch)
+            # Merge the oldest spool files into one request so the backlog
+            # drains faster than new readings arrive.
+            updates, paths = [], []
+            for name in self._spool_files():
+                path = os.path.join(self.spool_dir, name)
+                with open(path) as f:
+                    spooled = json.load(f)
+                if paths and len(updates) + len(spooled) > self.max_batch:
+                    break
+                updates.extend(spooled)
+                paths.append(path)
+            result = self._send(updates)
+            if result == SENT:
+                for path in paths:
+                    os.remove(path)
+            elif result == REJECTED:
+                for path in paths:
+                    os.replace(path, os.path.join(self.rejected_dir, os.path.basename(path)))
+                self._evict(self.rejected_dir)
+            return
+
+        if batch:
+            result = self._send(batch)
+            if result == RETRY:
+                self._spool(batch)
+            elif result == REJECTED:
+                self._spool(batch, self.rejected_dir)
+
+    def _send(self, updates):
+        """Posts one bulk update. Returns SENT, RETRY or REJECTED and adjusts the backoff."""
+        body = {"write_api_key": self.write_api_key, "updates": updates}
+        try:
+            response = self.session.post(self.url, json=body, timeout=self.timeout)
+            status = response.status_code
+            if 200 <= status < 300:
+                result = SENT
+            else:
+                log.error("ThingSpeak responded %s: %s", status, response.text[:200])
+                result = REJECTED if 400 <= status < 500 and status != 429 else RETRY
+        except requests.exceptions.RequestException as e:
+            log.error("Error sending data to ThingSpeak: %s", e)
+            result = RETRY
+
+        if result == SENT:
+            self.sent += len(updates)
+            self.backoff = 0
+            self.retry_at = 0.0
+        elif result == REJECTED:
+            self.rejected += len(updates)
+        else:
+            self.failures += 1
+            self.backoff = min(self.max_backoff, max(self.interval, self.backoff * 2))
+            self.retry_at = time.monotonic() + self.backoff * random.uniform(0.5, 1.0)
+        return result
+
+    def _spool_files(self, directory=None):
+        return sorted(name for name in os.listdir(directory or self.spool_dir) if name.endswith(".json"))
+
+    def _spool(self, updates, directory=None):
+        """Writes a batch to the spool (or `directory`), evicting the oldest files past `max_spool_files`."""
+        if not updates:
+            return
+        directory = directory or self.spool_dir
+        atomic_write(os.path.join(directory, f"spool-{time.time_ns():020d}.json"), json.dumps(updates))
+        if directory == self.spool_dir:
+            self.spooled += len(updates)
+        self._evict(directory)
+
+    def _evict(self, directory):
+        """Removes the oldest files in `directory` past `max_spool_files`."""
+        spool_files = self._spool_files(directory)
+        for expired in spool_files[:max(0, len(spool_files) - self.max_spool_files)]:
+            os.remove(os.path.join(directory, expired))
+            self.spool_evictions += 1
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "spool_files": len(self._spool_files()),
+            "sent": self.sent,
+            "spooled": self.spooled,
+            "failures": self.failures,
+            "drops": self.drops,
+            "spool_evictions": self.spool_evictions,
+            "rejected": self.rejected,
+            "backoff": self.backoff,
+        }
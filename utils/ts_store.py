@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import numpy as np
+from utils.fileio import atomic_write
+from utils.ring_buffer import FIELDS
+
+# Fixed-width little-endian record, 28 bytes per reading.
+RECORD_DTYPE = np.dtype([("timestamp", "<i8")] + [(name, np.dtype(dtype).newbyteorder("<")) for name, dtype in FIELDS])
+
+INDEX_FILE = "index.json"
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".bin"
+
+
+class TimeSeriesStore:
+    def __init__(self, path="data/history", segment_records=65536, max_segments=None, readonly=False):
+        """Opens (or creates) an append-only store of sensor readings under `path`.
+
+        Readings are written as fixed-width binary records into segment files
+        that rotate every `segment_records` records. index.json keeps the
+        min/max timestamp and record count of every sealed segment, so opening
+        the store only reads that file and stats the active segment.
+
+        A `readonly` store never writes; it follows a writer in another process
+        by reloading the index when it changes and re-stating the active
+        segment on every query.
+        """
+        self.path = path
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self.index_stamp = None
+        self.active_file = None
+        if not readonly:
+            os.makedirs(self.path, exist_ok=True)
+
+        self.segments = self._load_index()
+        self._open_active()
+
+    def _segment_path(self, name):
+        return os.path.join(self.path, name)
+
+    def _load_index(self):
+        """Loads the sealed segment index, or returns an empty one."""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        try:
+            st = os.stat(index_path)
+        except FileNotFoundError:
+            return []
+        self.index_stamp = (st.st_ino, st.st_mtime_ns)
+        with open(index_path) as f:
+            return json.load(f).get("segments", [])
+
+    def _save_index(self):
+        """Atomically rewrites index.json with the sealed segments."""
+        atomic_write(os.path.join(self.path, INDEX_FILE),
+                     json.dumps({"record_size": RECORD_DTYPE.itemsize, "segments": self.segments}))
+
+    def _open_active(self):
+        """Picks up the unsealed segment left by a previous run, or starts a new one."""
+        sealed = {seg["name"] for seg in self.segments}
+        existing = [] if not os.path.isdir(self.path) else sorted(
+            name for name in os.listdir(self.path)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX) and name not in sealed
+        )
+        if existing:
+            name = existing[-1]
+            seq = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+        else:
+            last = self.segments[-1]["name"] if self.segments else None
+            seq = int(last[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1 if last else 1
+            name = f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}"
+
+        path = self._segment_path(name)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        count = size // RECORD_DTYPE.itemsize
+        if size != count * RECORD_DTYPE.itemsize and not self.readonly:
+            # Drop a torn record from an unclean shutdown.
+            with open(path, "r+b") as f:
+                f.truncate(count * RECORD_DTYPE.itemsize)
+
+        self.active = {"name": name, "seq": seq, "count": count, "min_ts": None, "max_ts": None}
+        if count:
+            records = self._map(self.active)
+            self.active["min_ts"] = int(records["timestamp"][0])
+            self.active["max_ts"] = int(records["timestamp"][-1])
+        if not self.readonly:
+            self.active_file = open(path, "ab")
+
+    def _seal_active(self):
+        """Closes the active segment, records it in the index and starts a new one."""
+        self.active_file.close()
+        self.segments.append({
+            "name": self.active["name"],
+            "min_ts": self.active["min_ts"],
+            "max_ts": self.active["max_ts"],
+            "count": self.active["count"],
+        })
+        if self.max_segments is not None:
+            while len(self.segments) > self.max_segments:
+                expired = self.segments.pop(0)
+                try:
+                    os.remove(self._segment_path(expired["name"]))
+                except FileNotFoundError:
+                    pass
+        self._save_index()
+
+        seq = self.active["seq"] + 1
+        name = f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}"
+        self.active = {"name": name, "seq": seq, "count": 0, "min_ts": None, "max_ts": None}
+        self.active_file = open(self._segment_path(name), "ab")
+
+    def _map(self, segment):
+        """Memory-maps the first `count` records of a segment."""
+        return np.memmap(self._segment_path(segment["name"]), dtype=RECORD_DTYPE, mode="r", shape=(segment["count"],))
+
+    def append(self, timestamp, data):
+        """Appends one reading to the active segment."""
+        if self.readonly:
+            raise ValueError("Cannot append to a read-only store")
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record["timestamp"] = timestamp
+        for name, _ in FIELDS:
+            record[name] = data.get(name, 0)
+
+        with self.lock:
+            self.active_file.write(record.tobytes())
+            self.active_file.flush()
+            if self.active["min_ts"] is None:
+                self.active["min_ts"] = int(timestamp)
+            self.active["max_ts"] = int(timestamp)
+            self.active["count"] += 1
+            if self.active["count"] >= self.segment_records:
+                self._seal_active()
+
+    def _refresh(self):
+        """Catches a read-only store up with the writer: new sealed segments and the active segment's size."""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        try:
+            st = os.stat(index_path)
+            stamp = (st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        if stamp != self.index_stamp:
+            self.segments = self._load_index()
+            self._open_active()
+            return
+
+        try:
+            count = os.path.getsize(self._segment_path(self.active["name"])) // RECORD_DTYPE.itemsize
+        except FileNotFoundError:
+            count = 0
+        if count != self.active["count"]:
+            self.active["count"] = count
+            if count:
+                records = self._map(self.active)
+                self.active["min_ts"] = int(records["timestamp"][0])
+                self.active["max_ts"] = int(records["timestamp"][-1])
+
+    def _snapshot(self):
+        """Returns a consistent list of readable segments, oldest first."""
+        with self.lock:
+            if self.readonly:
+                self._refresh()
+            segments = list(self.segments)
+            if self.active["count"]:
+                segments.append(dict(self.active))
+        return segments
+
+    def __len__(self):
+        return sum(seg["count"] for seg in self._snapshot())
+
+    def time_range(self):
+        """Returns the (first, last) stored timestamps, or None when the store is empty."""
+        segments = self._snapshot()
+        if not segments:
+            return None
+        return segments[0]["min_ts"], segments[-1]["max_ts"]
+
+    def query(self, start_ts=None, end_ts=None, limit=None):
+        """Returns columns for the readings with timestamp in [start_ts, end_ts].
+
+        Only segments whose min/max range overlaps the query are mapped. With
+        `limit`, only the most recent `limit` matching readings are returned
+        and older segments are not touched once enough have been collected.
+        """
+        parts = []
+        remaining = limit
+        for seg in reversed(self._snapshot()):
+            if remaining is not None and remaining <= 0:
+                break
+            if start_ts is not None and seg["max_ts"] < start_ts:
+                continue
+            if end_ts is not None and seg["min_ts"] > end_ts:
+                continue
+            records = self._map(seg)
+            timestamps = records["timestamp"]
+            lo = 0 if start_ts is None else np.searchsorted(timestamps, start_ts, side="left")
+            hi = len(timestamps) if end_ts is None else np.searchsorted(timestamps, end_ts, side="right")
+            if remaining is not None:
+                lo = max(lo, hi - remaining)
+                remaining -= max(0, hi - lo)
+            if hi > lo:
+                parts.append(records[lo:hi])
+        parts.reverse()
+        return self._to_columns(parts)
+
+    def tail(self, n):
+        """Returns columns for the most recent `n` readings."""
+        return self.query(limit=n)
+
+    def _to_columns(self, parts):
+        """Turns record slices into a dict of column arrays."""
+        if not parts:
+            records = np.zeros(0, dtype=RECORD_DTYPE)
+        elif len(parts) == 1:
+            records = parts[0]
+        else:
+            records = np.concatenate(parts)
+        return {name: records[name] for name in RECORD_DTYPE.names}
+
+    def close(self):
+        """Flushes and closes the active segment."""
+        with self.lock:
+            if self.active_file is not None:
+                self.active_file.close()